@@ -1,23 +1,60 @@
-import os, datetime, subprocess, base64, json
-from github import Github
-from PIL import Image, ImageEnhance 
-import signal
+import os, base64, json
+import re
+import shutil
+import sqlite3
+import threading
 import time
-from fastapi import UploadFile, File   
-import requests
-import uvicorn 
-import os
-import base64
-import requests
+import uuid
+import heapq
+import itertools
+import random
+import socket
+import weakref
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
 import traceback
+from html.parser import HTMLParser
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter as MetricCounter, Gauge, Histogram, generate_latest,
+    multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
 # --- FastAPI Imports ---
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 
+@asynccontextmanager
+async def lifespan(app):
+    # Open (and migrate) the shared SQLite file off the event loop
+    await asyncio.to_thread(get_job_store)
+    await asyncio.to_thread(get_outbox)
+    # Jobs of a process that died are taken over right away (running ones are re-run)
+    released = await asyncio.to_thread(get_job_store().release_dead_owners)
+    if released:
+        log(f"🔁 Released {released} jobs of stopped workers")
+    # Resume Pages tracking for jobs that were pushed but not yet notified
+    await resume_orphaned_deployments()
+    workers = [asyncio.create_task(job_worker(i)) for i in range(WORKER_COUNT)]
+    dispatcher = asyncio.create_task(dispatch_notifications())
+    heartbeat = asyncio.create_task(renew_job_leases())
+    yield
+    background = workers + [dispatcher, heartbeat] + list(deployment_tasks) + list(mirror_tasks)
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    # Release pooled connections on shutdown
+    await close_http_clients()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
 
 # --- FastAPI App Initialization ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware (Good practice for any API)
 app.add_middleware(
@@ -34,66 +71,969 @@ def home():
     
 EXPECTED_SECRET = os.environ.get("PROJECT_SECRET")
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+# "atomic" pushes one commit per round via the Git Data API,
+# "contents" falls back to one Contents API call per file
+GITHUB_PUSH_MODE = os.environ.get("GITHUB_PUSH_MODE", "atomic")
+# Shallow bare mirrors of the task repos, for round 2 after the workspace is gone.
+# Point it at a persistent volume; empty disables mirrors.
+GIT_MIRROR_DIR = os.environ.get("GIT_MIRROR_DIR", "git_mirrors")
+GIT_TIMEOUT = float(os.environ.get("GIT_TIMEOUT", "60"))
+GIT_CONCURRENCY = int(os.environ.get("GIT_CONCURRENCY", "2"))
+# Mirrors are evicted by age, then least recently used, past these limits
+GIT_MIRROR_MAX_BYTES = int(os.environ.get("GIT_MIRROR_MAX_BYTES", str(1024 * 1024 * 1024)))
+GIT_MIRROR_MAX_AGE = float(os.environ.get("GIT_MIRROR_MAX_AGE", str(7 * 24 * 3600)))
+GIT_MIRROR_MAX_REPOS = int(os.environ.get("GIT_MIRROR_MAX_REPOS", "1000"))
+
+# Upper bounds on concurrent outbound calls, shared by all in-flight jobs
+GITHUB_CONCURRENCY = int(os.environ.get("GITHUB_CONCURRENCY", "10"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+# Most of those LLM slots the jobs of one batch submission may hold, so single submissions still get through
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", str(max(1, LLM_CONCURRENCY * 3 // 4))))
+HTTP_CONCURRENCY = int(os.environ.get("HTTP_CONCURRENCY", "20"))
+
+# Worker processes (python app.py, or uvicorn --workers, which reads the same variable)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Shared GitHub request budget: sustained requests/second and burst size, for all processes together
+GITHUB_RATE = float(os.environ.get("GITHUB_RATE", "10"))
+GITHUB_BURST = float(os.environ.get("GITHUB_BURST", "20"))
+# Retries of a rate-limited / transiently failing GitHub call before giving up
+GITHUB_MAX_RETRIES = int(os.environ.get("GITHUB_MAX_RETRIES", "5"))
+
+# How long discovered GitHub users, repos and branch heads are trusted (seconds)
+GITHUB_CACHE_TTL = float(os.environ.get("GITHUB_CACHE_TTL", "600"))
+GITHUB_CACHE_SIZE = int(os.environ.get("GITHUB_CACHE_SIZE", "1000"))
+
+# Pages readiness polling: first interval, growth factor, cap and hard deadline (seconds)
+PAGES_POLL_INTERVAL = float(os.environ.get("PAGES_POLL_INTERVAL", "3"))
+PAGES_POLL_BACKOFF = float(os.environ.get("PAGES_POLL_BACKOFF", "1.5"))
+PAGES_POLL_MAX_INTERVAL = float(os.environ.get("PAGES_POLL_MAX_INTERVAL", "20"))
+PAGES_DEADLINE = float(os.environ.get("PAGES_DEADLINE", "600"))
+
+github_semaphore = asyncio.Semaphore(GITHUB_CONCURRENCY)
+git_semaphore = asyncio.Semaphore(GIT_CONCURRENCY)
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+http_semaphore = asyncio.Semaphore(HTTP_CONCURRENCY)
+
+# Attachment ingestion: parallelism, size cap and streaming chunk sizes
+ATTACHMENT_CONCURRENCY = int(os.environ.get("ATTACHMENT_CONCURRENCY", "4"))
+ATTACHMENT_MAX_BYTES = int(os.environ.get("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+BASE64_CHUNK_CHARS = 64 * 1024  # multiple of 4
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+WHITESPACE_RE = re.compile(r"\s+")
+attachment_semaphore = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+
+# API key and base URL for the OpenAI-compatible endpoint
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
+
+_http_client = None
+_openai_client = None
+_github_api = None
+
+
+def get_http_client():
+    """Shared pooled client for attachments, Pages checks and evaluator calls"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            transport=InstrumentedTransport(
+                stage_destination,
+                limits=httpx.Limits(max_connections=HTTP_CONCURRENCY, max_keepalive_connections=HTTP_CONCURRENCY)
+            ),
+            timeout=httpx.Timeout(10.0),
+            follow_redirects=True
+        )
+    return _http_client
+
+
+def get_openai_client():
+    """Shared async OpenAI client, created on first use"""
+    global _openai_client
+    if _openai_client is None:
+        # Imported here: the SDK is the slowest import and only generation needs it
+        import openai
+        _openai_client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            http_client=httpx.AsyncClient(
+                transport=InstrumentedTransport(lambda request: "openai"),
+                timeout=httpx.Timeout(600.0, connect=5.0),
+                follow_redirects=True
+            )
+        )
+    return _openai_client
+
+
+async def close_http_clients():
+    global _http_client, _openai_client, _github_api
+    if _github_api is not None:
+        await _github_api.aclose()
+        _github_api = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+
+
+# --- Durable job queue ---
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "jobs.db")
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "4"))
+# Responses of recent submissions, keyed on (task, round, nonce)
+NONCE_CACHE_SIZE = int(os.environ.get("NONCE_CACHE_SIZE", "10000"))
+NONCE_CACHE_TTL = float(os.environ.get("NONCE_CACHE_TTL", "3600"))
+# Largest number of submissions accepted by one POST /api-endpoint/batch
+BATCH_MAX_SUBMISSIONS = int(os.environ.get("BATCH_MAX_SUBMISSIONS", "1000"))
+# Admission control: past these limits the submission endpoints answer 429/503 with
+# Retry-After. Round-2 updates of tasks that already ran skip the queued-jobs limit.
+ADMISSION_MAX_QUEUED_JOBS = int(os.environ.get("ADMISSION_MAX_QUEUED_JOBS", "500"))
+# Payload bytes (mostly inline base64 attachments) of the queued jobs of all processes
+ADMISSION_MAX_QUEUED_BYTES = int(os.environ.get("ADMISSION_MAX_QUEUED_BYTES", str(512 * 1024 * 1024)))
+# Request bodies being read and parsed by this process at the same time
+ADMISSION_MAX_BUFFERED_BYTES = int(os.environ.get("ADMISSION_MAX_BUFFERED_BYTES", str(128 * 1024 * 1024)))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "30"))
+# Running jobs plus tracked deployments per process; workers stop claiming at this many
+MAX_IN_FLIGHT_JOBS = int(os.environ.get("MAX_IN_FLIGHT_JOBS", "100"))
+# A claimed job belongs to one process for JOB_LEASE_TTL seconds and is renewed
+# by its heartbeat; other processes (uvicorn workers) take it over once it lapses
+JOB_LEASE_TTL = float(os.environ.get("JOB_LEASE_TTL", "60"))
+JOB_HEARTBEAT_INTERVAL = JOB_LEASE_TTL / 4
+# Done and failed jobs are deleted this many seconds after they finished (checked hourly)
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_PURGE_INTERVAL = 3600
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Id of the job the current coroutine is working on (None outside workers)
+current_job_id = ContextVar("current_job_id", default=None)
+# Pipeline stage the current coroutine is in (see job_stage)
+current_stage = ContextVar("current_stage", default=None)
+# Outbound HTTP calls of the current job by destination (shared with its tracker task)
+current_job_calls = ContextVar("current_job_calls", default=None)
+# Batch submission the current job came in with (None for single submissions)
+current_batch_id = ContextVar("current_batch_id", default=None)
+
+
+def log(*args, **kwargs):
+    """print() prefixed with the current job ID, so log lines of one job can be correlated"""
+    job_id = current_job_id.get()
+    if job_id:
+        args = (f"[job {job_id[:8]}]",) + args
+    print(*args, **kwargs)
+
+
+# --- Metrics (served on /metrics) ---
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Duration of each job pipeline stage", ["stage", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+)
+JOB_SECONDS = Histogram(
+    "job_seconds", "Submission to final state, per round and final status", ["round", "status"],
+    buckets=(1, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+)
+OUTBOUND_REQUESTS = MetricCounter(
+    "outbound_http_requests_total", "Outbound HTTP requests by destination and status class",
+    ["destination", "status"]
+)
+OUTBOUND_SECONDS = Histogram(
+    "outbound_http_request_seconds", "Time to response headers of outbound HTTP requests", ["destination"]
+)
+# Per-process gauges are summed over live processes in multi-worker mode
+OUTBOUND_IN_FLIGHT = Gauge(
+    "outbound_http_in_flight", "Outbound HTTP requests in flight", ["destination"], multiprocess_mode="livesum"
+)
+HTML_VALIDATIONS = MetricCounter(
+    "html_validations_total", "Generated pages by static validation outcome", ["outcome"]
+)
+LLM_REQUESTS = MetricCounter(
+    "llm_requests_total", "LLM completion attempts by model and outcome (skipped: circuit breaker open)",
+    ["model", "outcome"]
+)
+LLM_HEDGES = MetricCounter("llm_hedges_total", "Hedged LLM requests by which attempt won", ["winner"])
+LLM_TOKENS = MetricCounter(
+    "llm_tokens_total", "Tokens reported by the LLM provider (cached is the part of prompt served from its prefix cache)",
+    ["kind"]
+)
+LLM_TTFB_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed token, per prompt version", ["prompt_version"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 60)
+)
+ADMISSION_REJECTIONS = MetricCounter(
+    "admission_rejections_total", "Submissions turned away by admission control", ["reason"]
+)
+DEPLOYMENTS_TRACKED = Gauge(
+    "deployments_tracked", "Detached Pages/notify trackers running", multiprocess_mode="livesum"
+)
 
-import openai
 
-# Set  API key and base URL
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-openai.api_base = os.environ.get("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
+class QueueCollector:
+    """Queue depth by status and pending notifications, read from the shared SQLite file at scrape time"""
 
+    def collect(self):
+        jobs = GaugeMetricFamily("jobs", "Jobs in the queue by status", labels=["status"])
+        counts = get_job_store().count_by_status()
+        for status in ("queued", "running", "deploying", "done", "failed", "superseded"):
+            jobs.add_metric([status], counts.get(status, 0))
+        yield jobs
+        yield GaugeMetricFamily(
+            "outbox_pending", "Evaluator notifications waiting for delivery", value=get_outbox().counts().get("pending", 0)
+        )
 
-# Load templates
-with open("LICENSE", "r") as f:
-    LICENSE_TEMPLATE = f.read()
 
-README_TEMPLATE = """# {APP_NAME}
-This repository was automatically generated for task **{TASK_NAME}**.
-"""
-def decode_attachments(attachments, app_folder):
+# Kept apart from the per-process metrics: the same numbers whichever worker is scraped
+queue_registry = CollectorRegistry()
+queue_registry.register(QueueCollector())
+
+# Shared-client calls are attributed by the stage they are made from
+STAGE_DESTINATIONS = {"attachments": "attachments", "notify": "evaluator"}
+
+
+def stage_destination(request):
+    return STAGE_DESTINATIONS.get(current_stage.get(), "other")
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Counts and times outbound requests per destination, globally and for the current job"""
+
+    def __init__(self, destination, **transport_options):
+        self.destination = destination
+        self.transport = httpx.AsyncHTTPTransport(**transport_options)
+
+    async def handle_async_request(self, request):
+        destination = self.destination(request)
+        job_calls = current_job_calls.get()
+        if job_calls is not None:
+            job_calls[destination] += 1
+        status = "error"
+        started = time.perf_counter()
+        OUTBOUND_IN_FLIGHT.labels(destination).inc()
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            OUTBOUND_IN_FLIGHT.labels(destination).dec()
+            OUTBOUND_SECONDS.labels(destination).observe(time.perf_counter() - started)
+            OUTBOUND_REQUESTS.labels(destination, status).inc()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
     """
-    Decode and save attachments to app_folder.
-    Returns list of saved attachment info with name, path, type, size.
+    SQLite-backed job queue. Jobs survive process restarts and carry
+    per-stage timestamps so the backlog can be inspected via /jobs.
+    Several processes can share one file: running and deploying jobs are
+    leased to the process (owner) working on them. Methods block (on the
+    lock and SQLite's busy timeout), so async code calls them through
+    asyncio.to_thread.
     """
-    os.makedirs(app_folder, exist_ok=True)
-    saved = []
 
-    for att in attachments:
-        filename = att.get("name") or att.get("filename")
-        content = att.get("url") or att.get("content")
-        if not filename or not content:
+    def __init__(self, path, owner):
+        self.owner = owner
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.transaction():
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    round INTEGER NOT NULL,
+                    nonce TEXT,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stages TEXT NOT NULL DEFAULT '{}',
+                    stats TEXT NOT NULL DEFAULT '{}',
+                    error TEXT,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    batch_id TEXT,
+                    priority INTEGER NOT NULL DEFAULT 1,
+                    superseded_by TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # Files created before leases / batches / priorities / supersession existed
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("lease_owner", "TEXT"), ("lease_expires_at", "REAL"), ("batch_id", "TEXT"),
+                                        ("priority", "INTEGER NOT NULL DEFAULT 1"), ("superseded_by", "TEXT")):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_task_round ON jobs (task, round, created_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, status)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_superseded_by ON jobs (superseded_by)")
+            # One job per (task, round, nonce): evaluator retries map onto the same job
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_idempotency ON jobs (task, round, nonce)")
+            # Pauses every process must respect, e.g. a GitHub rate limit hit by one of them
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pauses (name TEXT PRIMARY KEY, until REAL NOT NULL)")
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction that also holds SQLite's lock, so other processes wait for it"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["stages"] = json.loads(job["stages"])
+        job["stats"] = json.loads(job["stats"])
+        return job
+
+    def enqueue(self, data):
+        """
+        Persist a new queued job; the secret is never written to disk.
+        Returns (job, created). A repeat of an existing (task, round, nonce)
+        returns the existing job with created=False.
+        """
+        return self.enqueue_many([data])[0]
+
+    def enqueue_many(self, submissions, batch_id=None):
+        """
+        enqueue() for a group of submissions in a single transaction; returns
+        [(job, created)]. Updates of tasks that already ran get priority 0.
+        """
+        now = time.time()
+        inserted = []
+        with self.transaction():
+            for data in submissions:
+                payload = {key: value for key, value in data.items() if key != "secret"}
+                job_id = uuid.uuid4().hex
+                priority = 0 if self._is_update(data["task"], data["round"]) else 1
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO jobs "
+                    "(id, task, round, nonce, status, payload, stages, batch_id, priority, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, data["task"], data["round"], data.get("nonce"), json.dumps(payload),
+                     json.dumps({"queued": {"started": now}}), batch_id, priority, now, now)
+                )
+                if cursor.rowcount == 0:
+                    row = self.conn.execute(
+                        "SELECT * FROM jobs WHERE task = ? AND round = ? AND nonce = ?",
+                        (data["task"], data["round"], data.get("nonce"))
+                    ).fetchone()
+                    inserted.append((row, False))
+                    continue
+                # An older, not yet started submission of the same task round would only
+                # produce a result that this one overwrites, so it is skipped. It follows
+                # this job instead: notified with its own nonce when this one deploys, failed
+                # if this one fails. Jobs those had superseded move over to this one.
+                older = [row["id"] for row in self.conn.execute(
+                    "SELECT id FROM jobs WHERE task = ? AND round = ? AND status = 'queued' AND id != ?",
+                    (data["task"], data["round"], job_id)
+                )]
+                if older:
+                    marks = ", ".join("?" * len(older))
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'superseded', superseded_by = ?, error = ?, updated_at = ? "
+                        f"WHERE id IN ({marks}) OR (status = 'superseded' AND superseded_by IN ({marks}))",
+                        (job_id, f"superseded by job {job_id}", now, *older, *older)
+                    )
+                    log(f"⏭️ Superseded {len(older)} queued job(s) for {data['task']} round {data['round']}")
+                row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                inserted.append((row, True))
+        return [(self._to_dict(row), created) for row, created in inserted]
+
+    def _is_update(self, task, round_number):
+        row = self.conn.execute(
+            "SELECT 1 FROM jobs WHERE task = ? AND round < ? AND status IN ('running', 'deploying', 'done') LIMIT 1",
+            (task, round_number)
+        ).fetchone()
+        return row is not None
+
+    def is_update(self, task, round_number):
+        """Whether this is a later round of a task whose earlier round already ran"""
+        with self.lock:
+            return self._is_update(task, round_number)
+
+    def queue_load(self):
+        """(queued jobs, bytes of their payloads) across all processes"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM jobs WHERE status = 'queued'"
+            ).fetchone()
+        return row[0], row[1]
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def get_latest(self, task, round_number):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE task = ? AND round = ? ORDER BY created_at DESC LIMIT 1",
+                (task, round_number)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def claim_next(self):
+        """
+        Atomically lease the oldest queued job (or a running job whose owner
+        stopped renewing its lease) to this process and return it.
+        Jobs of a task that already has a live running job are skipped, so the
+        rounds of one task never work on its folder and repo at the same time.
+        A job also waits while an earlier round of its task is still to run, so
+        a round-1 re-run never overwrites the round-2 page pushed before it.
+        Updates of tasks that already ran go first. Then jobs of the batch with
+        the fewest running jobs (single submissions count as a batch of their
+        own), so batches fan out side by side instead of one after the other.
+        """
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute(
+                "SELECT * FROM jobs j WHERE (status = 'queued' "
+                "OR (status = 'running' AND COALESCE(lease_expires_at, 0) < ?)) "
+                "AND task NOT IN (SELECT task FROM jobs WHERE status = 'running' AND lease_expires_at >= ?) "
+                "AND NOT EXISTS (SELECT 1 FROM jobs o WHERE o.task = j.task AND o.round < j.round "
+                "AND (o.status = 'queued' OR (o.status = 'running' AND COALESCE(o.lease_expires_at, 0) < ?))) "
+                "ORDER BY priority, "
+                "(SELECT COUNT(*) FROM jobs b WHERE b.batch_id = j.batch_id AND b.status = 'running'), "
+                "created_at LIMIT 1",
+                (now, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            stages = json.loads(row["stages"])
+            stages.setdefault("queued", {}).setdefault("finished", now)
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', stages = ?, lease_owner = ?, lease_expires_at = ?, "
+                "updated_at = ? WHERE id = ?",
+                (json.dumps(stages), self.owner, now + JOB_LEASE_TTL, now, row["id"])
+            )
+        if row["status"] == "running":
+            log(f"🔁 Took over job {row['id']} from {row['lease_owner']} (lease expired)")
+        return self.get(row["id"])
+
+    def claim_orphaned_deployments(self):
+        """Lease deploying jobs whose tracker stopped renewing (e.g. its process died)"""
+        now = time.time()
+        with self.transaction():
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = 'deploying' AND COALESCE(lease_expires_at, 0) < ?",
+                (now,)
+            ).fetchall()
+            for row in rows:
+                self.conn.execute(
+                    "UPDATE jobs SET lease_owner = ?, lease_expires_at = ? WHERE id = ?",
+                    (self.owner, now + JOB_LEASE_TTL, row["id"])
+                )
+        return [self._to_dict(row) for row in rows]
+
+    def renew_leases(self, job_ids):
+        """Extend this process's leases; returns the ids it still owns"""
+        job_ids = list(job_ids)
+        placeholders = ",".join("?" * len(job_ids))
+        with self.transaction():
+            self.conn.execute(
+                f"UPDATE jobs SET lease_expires_at = ? WHERE lease_owner = ? AND id IN ({placeholders}) "
+                "AND status IN ('running', 'deploying')",
+                (time.time() + JOB_LEASE_TTL, self.owner, *job_ids)
+            )
+            rows = self.conn.execute(
+                f"SELECT id FROM jobs WHERE lease_owner = ? AND id IN ({placeholders})",
+                (self.owner, *job_ids)
+            ).fetchall()
+        return {row["id"] for row in rows}
+
+    def release_dead_owners(self):
+        """
+        Expire leases held by processes on this host that no longer exist,
+        so a restarted (or crashed) worker's jobs are picked up right away
+        instead of after JOB_LEASE_TTL.
+        """
+        hostname = socket.gethostname()
+        with self.lock:
+            owners = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT lease_owner FROM jobs WHERE status IN ('running', 'deploying') "
+                "AND lease_owner IS NOT NULL AND lease_expires_at >= ?",
+                (time.time(),)
+            )]
+        released = 0
+        for owner in owners:
+            host, _, pid = owner.rpartition(":")
+            if owner == self.owner or host != hostname or not pid.isdigit() or pid_alive(int(pid)):
+                continue
+            with self.transaction():
+                released += self.conn.execute(
+                    "UPDATE jobs SET lease_expires_at = 0 WHERE lease_owner = ? AND status IN ('running', 'deploying')",
+                    (owner,)
+                ).rowcount
+        return released
+
+    def mark_stage(self, job_id, stage, event):
+        """Record a started/finished timestamp for one pipeline stage"""
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            stages.setdefault(stage, {})[event] = now
+            self.conn.execute(
+                "UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(stages), now, job_id)
+            )
+
+    def record_stats(self, job_id, **stats):
+        with self.transaction():
+            row = self.conn.execute("SELECT stats FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row["stats"])
+            merged.update(stats)
+            self.conn.execute("UPDATE jobs SET stats = ? WHERE id = ?", (json.dumps(merged), job_id))
+
+    def add_stats(self, job_id, **counts):
+        """Add counts to numeric stats (e.g. tokens summed over generation and repair calls)"""
+        with self.transaction():
+            row = self.conn.execute("SELECT stats FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row["stats"])
+            for key, value in counts.items():
+                merged[key] = merged.get(key, 0) + value
+            self.conn.execute("UPDATE jobs SET stats = ? WHERE id = ?", (json.dumps(merged), job_id))
+
+    def finish(self, job_id, status, error=None):
+        """
+        Move a job to status. Ignored (returns False) if another process has
+        taken the job over. "deploying" keeps the lease for the tracker and
+        only applies to a running job, so it never overwrites a final state.
+        """
+        now = time.time()
+        lease_expires_at = now + JOB_LEASE_TTL if status == "deploying" else None
+        lease_owner = self.owner if status == "deploying" else None
+        only_running = " AND status = 'running'" if status == "deploying" else ""
+        with self.transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_owner = ?, lease_expires_at = ?, updated_at = ? "
+                "WHERE id = ? AND (lease_owner IS NULL OR lease_owner = ?)" + only_running,
+                (status, error, lease_owner, lease_expires_at, now, job_id, self.owner)
+            )
+            if status == "done" and cursor.rowcount:
+                self._drop_attachment_contents("id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            log(f"⚠️ Job {job_id} is owned by another worker now, not marking it {status}")
+        return cursor.rowcount > 0
+
+    def superseded_jobs(self, job_id):
+        """Submissions waiting on job_id's result instead of running themselves"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE superseded_by = ? AND status = 'superseded'", (job_id,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def settle_superseded(self, job_id, status, error=None):
+        """Give the jobs job_id superseded its final status; failed ones are re-queued on retry"""
+        with self.transaction():
+            if status == "done":
+                self._drop_attachment_contents("superseded_by = ? AND status = 'superseded'", (job_id,))
+            return self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE superseded_by = ? AND status = 'superseded'",
+                (status, error, time.time(), job_id)
+            ).rowcount
+
+    def _drop_attachment_contents(self, where, params):
+        """
+        Keep only the names of the inline attachments of the matching jobs: once
+        a job is done they are in its repo and it never runs again. Failed jobs
+        keep theirs for a retry until purge_finished removes them.
+        """
+        rows = self.conn.execute(f"SELECT id, payload FROM jobs WHERE {where}", params).fetchall()
+        for row in rows:
+            payload = json.loads(row["payload"])
+            if not payload.get("attachments"):
+                continue
+            payload["attachments"] = [
+                {"name": att.get("name") or att.get("filename")} if isinstance(att, dict) else att
+                for att in payload["attachments"]
+            ]
+            self.conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(payload), row["id"]))
+
+    def purge_finished(self, older_than):
+        """Delete done and failed jobs that finished before older_than; returns how many"""
+        with self.transaction():
+            return self.conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,)
+            ).rowcount
+
+    def requeue(self, job_id):
+        """Put a failed job back on the queue"""
+        with self.transaction():
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, lease_owner = NULL, lease_expires_at = NULL, "
+                "updated_at = ? WHERE id = ? AND status = 'failed'",
+                (time.time(), job_id)
+            )
+
+    def share_pause(self, name, until=0.0):
+        """Record a pause until the wall-clock time until (if later); returns the latest pause of that name"""
+        if until > time.time():
+            with self.transaction():
+                self.conn.execute(
+                    "INSERT INTO pauses (name, until) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET until = MAX(until, excluded.until)",
+                    (name, until)
+                )
+        with self.lock:
+            row = self.conn.execute("SELECT until FROM pauses WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0.0
+
+    def running_tasks(self):
+        """Tasks with a running job in any process (their workspace folders are in use)"""
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT DISTINCT task FROM jobs WHERE status = 'running'")}
+
+    def count_by_status(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+
+class TTLCache:
+    """
+    Bounded, expiring in-process map (least recently written entries go first).
+    Used for idempotent responses and GitHub discovery results.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        return response
+
+    def put(self, key, response):
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+
+def idempotency_key(task, round_number, nonce):
+    return (str(task), str(round_number), str(nonce))
+
+
+_job_store = None
+_outbox = None
+# Guards opening the SQLite file, which threads and the event loop may both trigger
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Shared job queue, opened (and migrated) on first use"""
+    global _job_store
+    if _job_store is None:
+        with _store_lock:
+            if _job_store is None:
+                _job_store = JobStore(JOBS_DB_PATH, WORKER_ID)
+    return _job_store
+
+
+job_wakeup = asyncio.Event()
+# Lets repeated submissions return without touching the job store
+nonce_cache = TTLCache(NONCE_CACHE_SIZE, NONCE_CACHE_TTL)
+
+
+@asynccontextmanager
+async def job_stage(name):
+    """
+    Record started/finished timestamps of a pipeline stage on the current job.
+    The SQLite writes run in a thread, so a busy database does not stall the loop.
+    """
+    job_id = current_job_id.get()
+    if job_id:
+        await asyncio.to_thread(get_job_store().mark_stage, job_id, name, "started")
+    stage_token = current_stage.set(name)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        current_stage.reset(stage_token)
+        STAGE_SECONDS.labels(name, outcome).observe(elapsed)
+        log(f"⏱️ Stage {name} {outcome} in {elapsed:.2f}s")
+        if job_id:
+            await asyncio.to_thread(get_job_store().mark_stage, job_id, name, "finished")
+
+
+async def record_job_stats(**stats):
+    """Attach counters (bytes pushed, etc.) to the current job"""
+    job_id = current_job_id.get()
+    if job_id:
+        await asyncio.to_thread(get_job_store().record_stats, job_id, **stats)
+
+
+# --- Workspaces ---
+# Root of the per-task folders; point it at tmpfs (e.g. /dev/shm/workspaces) for speed
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", "workspaces")
+WORKSPACE_MAX_BYTES = int(os.environ.get("WORKSPACE_MAX_BYTES", str(500 * 1024 * 1024)))
+WORKSPACE_MAX_AGE = float(os.environ.get("WORKSPACE_MAX_AGE", str(7 * 24 * 3600)))
+WORKSPACE_MAX_TASKS = int(os.environ.get("WORKSPACE_MAX_TASKS", "1000"))
+
+
+def directory_size(path):
+    """Bytes of all files under path"""
+    size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+def evict_least_recently_used(folders, max_bytes, max_count, max_age, busy=()):
+    """
+    Remove the expired folders of [(last_used, bytes, path)], then the least
+    recently used ones until within max_bytes / max_count. Paths in busy are
+    kept. Returns the removed paths.
+    """
+    now = time.time()
+    folders = sorted(folders)
+    total = sum(size for _, size, _ in folders)
+    count = len(folders)
+    removed = []
+    for last_used, size, path in folders:
+        over_limit = total > max_bytes or count > max_count
+        if not over_limit and now - last_used <= max_age:
+            continue
+        if path in busy:
             continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+        total -= size
+        count -= 1
+    return removed
 
-        file_path = os.path.join(app_folder, filename)
-        try:
-            # --- Base64 ---
-            if content.startswith("data:") and "base64," in content:
-                base64_data = content.split("base64,")[1]
-                base64_data = base64_data.replace('\n', '').replace('\r', '')
-                # Auto decide text vs binary
-                if filename.endswith((".md", ".txt", ".csv", ".json")):
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(base64.b64decode(base64_data).decode("utf-8"))
+
+class WorkspaceManager:
+    """
+    Owns the per-task folders under WORKSPACE_ROOT.
+    After a push only index.html (what round 2 needs) is kept, and whole
+    task folders are evicted by age, then least-recently-used, once the
+    store exceeds its size or task-count limits. Folders of jobs that are
+    in progress, in this process or any other sharing the job store, are
+    never evicted.
+    """
+
+    KEEP_AFTER_PUSH = {"index.html"}
+
+    def __init__(self, root, max_bytes, max_age, max_tasks):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_tasks = max_tasks
+        self.in_use = {}
+        self.evictions = 0
+
+    @staticmethod
+    def folder_name(task_name):
+        """Filesystem-safe, collision-free folder name for a task"""
+        import hashlib
+
+        safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", str(task_name)).strip(".") or "task"
+        if safe_name != task_name:
+            safe_name += "-" + hashlib.sha1(str(task_name).encode("utf-8")).hexdigest()[:8]
+        return safe_name
+
+    def acquire(self, task_name):
+        """Create (or reuse) the task folder, mark it in use and return its path"""
+        path = os.path.join(self.root, self.folder_name(task_name))
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+        self.in_use[path] = self.in_use.get(path, 0) + 1
+        return path
+
+    def release(self, path):
+        self.in_use[path] -= 1
+        if self.in_use[path] <= 0:
+            del self.in_use[path]
+        os.utime(path)
+
+    def prune(self, path):
+        """Drop everything round 2 does not need"""
+        for filename in os.listdir(path):
+            if filename not in self.KEEP_AFTER_PUSH:
+                file_path = os.path.join(path, filename)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path, ignore_errors=True)
                 else:
-                    with open(file_path, "wb") as f:
-                        f.write(base64.b64decode(base64_data))
-                saved.append({"name": filename, "path": file_path, "type": "base64"})
+                    os.remove(file_path)
+
+    def _scan(self):
+        """[(last_used, bytes, path)] for every task folder"""
+        folders = []
+        if not os.path.isdir(self.root):
+            return folders
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                folders.append((entry.stat().st_mtime, directory_size(entry.path), entry.path))
+        return folders
+
+    def evict(self, busy_tasks=()):
+        """
+        Remove expired folders, then least recently used ones until within
+        limits. Folders of busy_tasks (running anywhere) are kept.
+        """
+        busy = set(self.in_use) | {os.path.join(self.root, self.folder_name(task)) for task in busy_tasks}
+        removed = evict_least_recently_used(self._scan(), self.max_bytes, self.max_tasks, self.max_age, busy)
+        for path in removed:
+            self.evictions += 1
+            log(f"🧹 Evicted workspace {os.path.basename(path)}")
+
+    def usage(self):
+        folders = self._scan()
+        return {
+            "root": self.root,
+            "tasks": len(folders),
+            "bytes": sum(size for _, size, _ in folders),
+            "in_use": len(self.in_use),
+            "evictions": self.evictions
+        }
+
+
+workspaces = WorkspaceManager(WORKSPACE_ROOT, WORKSPACE_MAX_BYTES, WORKSPACE_MAX_AGE, WORKSPACE_MAX_TASKS)
+
+
+# Shipped next to this file; read on first push rather than at import
+LICENSE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "LICENSE")
+_license_text = None
+
+
+def get_license_text():
+    global _license_text
+    if _license_text is None:
+        with open(LICENSE_PATH, "r") as f:
+            _license_text = f.read()
+    return _license_text
+
+
+README_TEMPLATE = """# {APP_NAME}
+This repository was automatically generated for task **{TASK_NAME}**.
+"""
+def decode_base64_to_file(content, start, file_path):
+    """
+    Decode the base64 text content[start:] into file_path chunk by chunk,
+    so only one chunk of decoded bytes is ever held in memory.
+    """
+    carry = ""
+    with open(file_path, "wb") as f:
+        for offset in range(start, len(content), BASE64_CHUNK_CHARS):
+            chunk = carry + WHITESPACE_RE.sub("", content[offset:offset + BASE64_CHUNK_CHARS])
+            usable = len(chunk) - len(chunk) % 4
+            f.write(base64.b64decode(chunk[:usable]))
+            carry = chunk[usable:]
+        if carry:
+            # Tolerate missing padding at the very end
+            f.write(base64.b64decode(carry + "=" * (-len(carry) % 4)))
+
+
+async def download_to_file(url, file_path):
+    """Stream a URL to file_path over the pooled client, capped at ATTACHMENT_MAX_BYTES"""
+    size = 0
+    async with http_semaphore:
+        async with get_http_client().stream("GET", url, timeout=10) as r:
+            r.raise_for_status()
+            with open(file_path, "wb") as f:
+                async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > ATTACHMENT_MAX_BYTES:
+                        raise ValueError(f"attachment larger than {ATTACHMENT_MAX_BYTES} bytes")
+                    f.write(chunk)
+    return size
+
+
+async def save_attachment(att, app_folder):
+    """Save one attachment; returns its info dict or None when it was skipped/failed"""
+    filename = att.get("name") or att.get("filename")
+    content = att.get("url") or att.get("content")
+    if not filename or not content:
+        return None
+
+    # Never let an attachment name escape the app folder
+    filename = os.path.basename(filename)
+    if filename in ("", ".", ".."):
+        log(f"[WARN] Skipping attachment with unusable name {att.get('name') or att.get('filename')!r}")
+        return None
+    file_path = os.path.join(app_folder, filename)
+    try:
+        async with attachment_semaphore:
+            # --- Base64 ---
+            # Only the data URI header is searched, not the whole payload
+            marker = content.find("base64,", 0, 256) if content.startswith("data:") else -1
+            if marker != -1:
+                await asyncio.to_thread(decode_base64_to_file, content, marker + len("base64,"), file_path)
+                return {"name": filename, "path": file_path, "type": "base64"}
 
             # --- URL ---
             elif content.startswith("http://") or content.startswith("https://"):
-                r = requests.get(content, timeout=10)
-                r.raise_for_status()
-                with open(file_path, "wb") as f:
-                    f.write(r.content)
-                saved.append({"name": filename, "path": file_path, "type": "url"})
+                await download_to_file(content, file_path)
+                return {"name": filename, "path": file_path, "type": "url"}
 
             else:
-                print(f"[WARN] Unknown attachment format for {filename}")
+                log(f"[WARN] Unknown attachment format for {filename}")
 
-        except Exception as e:
-            print(f"❌ Failed to save {filename}: {e}")
-            traceback.print_exc()
-    
-    return saved
+    except Exception as e:
+        log(f"❌ Failed to save {filename}: {e}")
+        traceback.print_exc()
+        # Only a partly written file; a directory of the same name (e.g. .git) stays
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+    return None
+
+
+async def decode_attachments(attachments, app_folder):
+    """
+    Decode and save attachments to app_folder, streaming straight to disk.
+    Up to ATTACHMENT_CONCURRENCY attachments are processed at once.
+    Returns list of saved attachment info with name, path, type.
+    """
+    os.makedirs(app_folder, exist_ok=True)
+    results = await asyncio.gather(*(save_attachment(att, app_folder) for att in attachments))
+    return [info for info in results if info is not None]
 
 def summarize_attachment_meta(saved_attachments):
     """
@@ -108,221 +1048,732 @@ def summarize_attachment_meta(saved_attachments):
         lines.append(f"- {att['name']} ({att['type']}, {size} bytes)")
     
     return "\n".join(lines)
-from io import BytesIO
-import requests
-import pytesseract
 
+class GitHubError(Exception):
+    """Non-2xx response from the GitHub REST API"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class GitHubScheduler:
+    """
+    Admission control for every GitHub call in the process.
+    A token bucket paces requests across all workers, responses feed back
+    X-RateLimit-Remaining/Reset and Retry-After, and secondary-limit hits
+    pause everyone with exponential backoff. When calls have to wait, those
+    from jobs closest to finishing go first.
+    With several processes each gets its share of the rate, and pauses are
+    exchanged through shared_pause(until) -> latest pause (wall clock) so a
+    limit hit by one process stops them all.
+    """
+
+    # Lower runs first: deploying jobs, then pushes, then everything else
+    STAGE_PRIORITY = {"notify": 0, "pages": 0, "push": 1}
+    DEFAULT_PRIORITY = 2
+    # GitHub asks for at least a minute when a secondary limit has no Retry-After
+    SECONDARY_BACKOFF_MIN = 60.0
+    SECONDARY_BACKOFF_MAX = 900.0
+
+    # Seconds between looks at the pauses of other processes
+    SHARED_SYNC_INTERVAL = 1.0
+
+    def __init__(self, rate, burst, shared_pause=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.shared_pause = shared_pause
+        self.shared_synced = float("-inf")
+        self.unshared_until = 0.0
+        self.secondary_backoff = 0.0
+        self.remaining = None
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.condition = asyncio.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def sync_shared(self):
+        """Publish this process's pause and adopt the others', at most every SHARED_SYNC_INTERVAL"""
+        now = time.monotonic()
+        if self.shared_pause is None:
+            return
+        if not self.unshared_until and now - self.shared_synced < self.SHARED_SYNC_INTERVAL:
+            return
+        self.shared_synced = now
+        until, self.unshared_until = self.unshared_until, 0.0
+        until = await asyncio.to_thread(self.shared_pause, until)
+        if until > time.time():
+            self.blocked_until = max(self.blocked_until, time.monotonic() + until - time.time())
+
+    async def acquire(self):
+        """Wait for this call's turn and a token"""
+        await self.sync_shared()
+        entry = (self.STAGE_PRIORITY.get(current_stage.get(), self.DEFAULT_PRIORITY), next(self.sequence))
+        async with self.condition:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self.blocked_until:
+                        timeout = self.blocked_until - now
+                    elif self.waiters[0] != entry:
+                        timeout = None  # Someone more urgent is ahead
+                    elif self.tokens < 1:
+                        timeout = (1 - self.tokens) / self.rate
+                    else:
+                        self.tokens -= 1
+                        return
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def block_for(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.unshared_until = max(self.unshared_until, time.time() + seconds)
+
+    def observe(self, response):
+        """
+        Update limits from a response. Returns True when the call was
+        rate limited and should be retried.
+        """
+        headers = response.headers
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if self.remaining == 0 and "X-RateLimit-Reset" in headers:
+            # Primary limit exhausted: nobody calls until the window resets
+            self.block_for(max(float(headers["X-RateLimit-Reset"]) - time.time(), 0) + 1)
+
+        if response.status_code not in (403, 429):
+            if response.status_code < 400:
+                self.secondary_backoff = 0.0
+            return False
+
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            self.block_for(float(retry_after))
+            return True
+        if self.remaining == 0:
+            return True
+        if "rate limit" in response.text.lower():
+            # Secondary limit without Retry-After: back off exponentially
+            self.secondary_backoff = min(
+                max(self.secondary_backoff * 2, self.SECONDARY_BACKOFF_MIN), self.SECONDARY_BACKOFF_MAX
+            )
+            self.block_for(self.secondary_backoff)
+            return True
+        return response.status_code == 429
+
+    def stats(self):
+        return {
+            "tokens": round(self.tokens, 2),
+            "waiting": len(self.waiters),
+            "blocked_for": round(max(self.blocked_until - time.monotonic(), 0), 1),
+            "rate_limit_remaining": self.remaining
+        }
+
+
+github_scheduler = GitHubScheduler(
+    GITHUB_RATE / WEB_CONCURRENCY, max(GITHUB_BURST / WEB_CONCURRENCY, 1),
+    shared_pause=(lambda until: get_job_store().share_pause("github", until)) if WEB_CONCURRENCY > 1 else None
+)
+
+
+class GitHubAPI:
+    """
+    Process-wide async client for the GitHub REST endpoints this app uses.
+    All GitHub traffic shares one connection pool, and discovery results
+    (authenticated user, repo metadata, branch heads, Pages state) are
+    cached for GITHUB_CACHE_TTL so repeat rounds of a task skip them.
+    """
+
+    def __init__(self, token):
+        self.client = httpx.AsyncClient(
+            transport=InstrumentedTransport(
+                lambda request: "github",
+                limits=httpx.Limits(max_connections=GITHUB_CONCURRENCY, max_keepalive_connections=GITHUB_CONCURRENCY)
+            ),
+            base_url=GITHUB_API_URL,
+            headers={
+                "Authorization": f"token {token}",
+                "Accept": "application/vnd.github+json"
+            },
+            timeout=httpx.Timeout(30.0)
+        )
+        self.user_cache = TTLCache(1, GITHUB_CACHE_TTL)
+        # Concurrent jobs (e.g. of one batch) wait for a single /user lookup
+        self.user_lock = asyncio.Lock()
+        self.repo_cache = TTLCache(GITHUB_CACHE_SIZE, GITHUB_CACHE_TTL)
+        self.head_cache = TTLCache(GITHUB_CACHE_SIZE, GITHUB_CACHE_TTL)
+        self.pages_cache = TTLCache(GITHUB_CACHE_SIZE, GITHUB_CACHE_TTL)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def request(self, method, path, **kwargs):
+        """
+        Send a request through the shared scheduler and return the decoded
+        JSON body. Rate-limited and 5xx responses are retried with backoff;
+        raises GitHubError on any other 4xx/5xx.
+        """
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            await github_scheduler.acquire()
+            async with github_semaphore:
+                response = await self.client.request(method, path, **kwargs)
+            rate_limited = github_scheduler.observe(response)
+            if attempt == GITHUB_MAX_RETRIES:
+                break
+            if rate_limited:
+                log(f"⏳ GitHub rate limit on {method} {path}, retrying (attempt {attempt + 1})")
+                continue
+            if response.status_code in (502, 503, 504):
+                await asyncio.sleep(2 ** attempt)
+                continue
+            break
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise GitHubError(response.status_code, message)
+        if not response.content:
+            return {}
+        return response.json()
+
+    async def get_user(self):
+        user = self.user_cache.get("user")
+        if user is None:
+            async with self.user_lock:
+                user = self.user_cache.get("user")
+                if user is None:
+                    user = await self.request("GET", "/user")
+                    self.user_cache.put("user", user)
+        return user
+
+    async def get_repo(self, owner, name):
+        """Repo metadata; raises GitHubError(404) when it does not exist"""
+        repo = self.repo_cache.get(f"{owner}/{name}")
+        if repo is None:
+            repo = await self.request("GET", f"/repos/{owner}/{name}")
+            self.remember_repo(repo)
+        return repo
+
+    def remember_repo(self, repo):
+        self.repo_cache.put(repo["full_name"], repo)
+
+    async def get_head(self, full_name, branch):
+        """
+        Head of a branch as {"commit", "tree", "files": {path: blob sha}}.
+        Returns (head, from_cache).
+        """
+        key = f"{full_name}@{branch}"
+        head = self.head_cache.get(key)
+        if head is not None:
+            return head, True
+
+        repo_path = f"/repos/{full_name}"
+        ref = await self.request("GET", f"{repo_path}/git/ref/heads/{branch}")
+        commit_sha = ref["object"]["sha"]
+        commit = await self.request("GET", f"{repo_path}/git/commits/{commit_sha}")
+        tree_sha = commit["tree"]["sha"]
+        # One call for the whole remote tree: path -> blob sha
+        tree = await self.request("GET", f"{repo_path}/git/trees/{tree_sha}", params={"recursive": "1"})
+        head = {
+            "commit": commit_sha,
+            "tree": tree_sha,
+            "files": {item["path"]: item["sha"] for item in tree["tree"] if item["type"] == "blob"}
+        }
+        self.head_cache.put(key, head)
+        return head, False
+
+    def remember_head(self, full_name, branch, head):
+        self.head_cache.put(f"{full_name}@{branch}", head)
+
+    def forget_head(self, full_name, branch):
+        self.head_cache.discard(f"{full_name}@{branch}")
+
+
+def get_github_api():
+    """Shared GitHub client, created on first use"""
+    global _github_api
+    if _github_api is None:
+        _github_api = GitHubAPI(GITHUB_TOKEN)
+    return _github_api
+
+
+class GitError(Exception):
+    """A git command failed or timed out"""
+
+
+class GitMirrors:
+    """
+    One shallow bare mirror per task repo under root. fetch() brings a branch
+    up to date with a depth-1 fetch, so only objects that are new since the
+    last fetch are transferred; head() and read() then answer locally.
+    A mirror only appears once its first fetch has succeeded. Like the
+    workspaces, mirrors are evicted by age, then least recently used, once
+    they exceed their size or repo-count limits.
+    """
+
+    def __init__(self, root, token, max_bytes=GIT_MIRROR_MAX_BYTES, max_age=GIT_MIRROR_MAX_AGE,
+                 max_repos=GIT_MIRROR_MAX_REPOS):
+        self.root = root
+        self.token = token
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_repos = max_repos
+        self.locks = weakref.WeakValueDictionary()
+        self.evictions = 0
+
+    def path_for(self, full_name):
+        return os.path.join(self.root, f"{full_name}.git")
+
+    def is_warm(self, full_name):
+        return os.path.isdir(self.path_for(full_name))
+
+    async def git(self, *args):
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+        if self.token:
+            # Passed through the environment so the token never shows up in argv or a config file
+            basic = base64.b64encode(f"x-access-token:{self.token}".encode()).decode()
+            env.update(GIT_CONFIG_COUNT="1", GIT_CONFIG_KEY_0="http.extraHeader",
+                       GIT_CONFIG_VALUE_0=f"Authorization: Basic {basic}")
+        async with git_semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "git", *args, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                )
+            except OSError as e:
+                raise GitError(f"cannot run git: {e}")
+            try:
+                out, err = await asyncio.wait_for(process.communicate(), GIT_TIMEOUT)
+            except BaseException:
+                process.kill()
+                await process.wait()
+                raise
+        if process.returncode:
+            message = (err.decode(errors="replace").strip().splitlines() or ["exit code %d" % process.returncode])[0]
+            raise GitError(f"git {args[2] if args[0] == '-C' else args[0]}: {message}")
+        return out
+
+    async def fetch(self, full_name, clone_url, branch="main"):
+        """Create or update the mirror of branch"""
+        path = self.path_for(full_name)
+        lock = self.locks.get(path)
+        if lock is None:
+            lock = self.locks[path] = asyncio.Lock()
+        refspec = f"+refs/heads/{branch}:refs/heads/{branch}"
+        async with lock:
+            if os.path.isdir(path):
+                await self.git("-C", path, "fetch", "--quiet", "--depth", "1", clone_url, refspec)
+                os.utime(path)
+                return
+            # Built next to its final place and moved in once complete
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            staging = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                await self.git("init", "--quiet", "--bare", staging)
+                await self.git("-C", staging, "fetch", "--quiet", "--depth", "1", clone_url, refspec)
+                try:
+                    os.rename(staging, path)
+                except OSError:
+                    pass  # another process finished its mirror first
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+    async def head(self, full_name, branch="main"):
+        """Mirrored head as {"commit", "tree", "files": {path: blob sha}}, like GitHubAPI.get_head"""
+        path = self.path_for(full_name)
+        ref = f"refs/heads/{branch}"
+        commit, tree = (await self.git("-C", path, "rev-parse", ref, f"{ref}^{{tree}}")).decode().split()
+        os.utime(path)
+        files = {}
+        for entry in (await self.git("-C", path, "ls-tree", "-r", "-z", ref)).decode().split("\0"):
+            if not entry:
+                continue
+            meta, file_path = entry.split("\t", 1)
+            _, kind, sha = meta.split()
+            if kind == "blob":
+                files[file_path] = sha
+        return {"commit": commit, "tree": tree, "files": files}
+
+    async def read(self, full_name, sha):
+        """Contents of a blob"""
+        return await self.git("-C", self.path_for(full_name), "cat-file", "blob", sha)
+
+    def _scan(self):
+        """[(last_used, bytes, path)] for every complete mirror (root/<owner>/<name>.git)"""
+        mirrors = []
+        if not os.path.isdir(self.root):
+            return mirrors
+        for owner in os.scandir(self.root):
+            if not owner.is_dir():
+                continue
+            for entry in os.scandir(owner.path):
+                if entry.is_dir() and entry.name.endswith(".git"):
+                    mirrors.append((entry.stat().st_mtime, directory_size(entry.path), entry.path))
+        return mirrors
+
+    def busy(self):
+        """Mirrors this process is fetching into right now"""
+        return {path for path, lock in self.locks.items() if lock.locked()}
+
+    def evict(self, busy=()):
+        """Remove expired mirrors, then least recently used ones until within limits; busy paths are kept"""
+        removed = evict_least_recently_used(self._scan(), self.max_bytes, self.max_repos, self.max_age, busy)
+        for path in removed:
+            self.evictions += 1
+            log(f"🧹 Evicted git mirror {os.path.relpath(path, self.root)}")
+
+    def usage(self):
+        mirrors = self._scan()
+        return {
+            "root": self.root,
+            "repos": len(mirrors),
+            "bytes": sum(size for _, size, _ in mirrors),
+            "evictions": self.evictions
+        }
 
 
+git_mirrors = GitMirrors(GIT_MIRROR_DIR, GITHUB_TOKEN) if GIT_MIRROR_DIR else None
+# Background mirror refreshes; referenced here so they are not garbage collected
+mirror_tasks = set()
 
 
-import base64
-import os
+async def refresh_git_mirror(full_name, clone_url):
+    try:
+        await git_mirrors.fetch(full_name, clone_url)
+    except GitError as e:
+        log(f"⚠️ Could not refresh the git mirror of {full_name}: {e}")
+    # A refresh can add a mirror, so this is where the mirror store is kept within its limits
+    await asyncio.to_thread(git_mirrors.evict, git_mirrors.busy())
 
 
+def schedule_mirror_refresh(full_name, clone_url):
+    """Bring the task's mirror up to the pushed commit off the critical path"""
+    if git_mirrors is None:
+        return
+    task = asyncio.create_task(refresh_git_mirror(full_name, clone_url))
+    mirror_tasks.add(task)
+    task.add_done_callback(mirror_tasks.discard)
 
 
+async def load_previous_code(task_name, index_file):
+    """
+    index.html of the task's last round and the paths in its repo, as
+    (code, repo_files). The code comes from the workspace if it is still
+    there, else from the task's git mirror after an incremental fetch, else
+    (cold mirror) from one read of the remote tree plus one blob. The file
+    list comes from the mirror or the remote tree, which the push reads anyway.
+    The head it fetches is remembered, so the push needs no further reads.
+    """
+    code = None
+    if os.path.exists(index_file):
+        with open(index_file, "r", encoding="utf-8") as f:
+            code = f.read()
+        await record_job_stats(previous_code_source="workspace")
 
-def create_or_update_repo(app_folder, task_name, round_number, brief):
+    gh = get_github_api()
+    user = await gh.get_user()
+    try:
+        repo = await gh.get_repo(user["login"], task_name)
+    except GitHubError as e:
+        if e.status != 404:
+            raise
+        if code is None:
+            log(f"⚠️ No repo for {task_name} yet, generating round 2 from scratch")
+        return code, set()
+    full_name = repo["full_name"]
+
+    if git_mirrors is not None and git_mirrors.is_warm(full_name):
+        try:
+            # With the code at hand the mirror's last fetch is recent enough for a file list
+            if code is None:
+                await git_mirrors.fetch(full_name, repo["clone_url"])
+            head = await git_mirrors.head(full_name)
+            if code is None:
+                sha = head["files"].get("index.html")
+                data = await git_mirrors.read(full_name, sha) if sha else None
+                gh.remember_head(full_name, "main", head)
+                await record_job_stats(previous_code_source="mirror")
+                log(f"🪞 Previous code of {full_name} read from its git mirror at {head['commit'][:8]}")
+                code = data.decode("utf-8", errors="replace") if data is not None else None
+            return code, set(head["files"])
+        except GitError as e:
+            log(f"⚠️ Git mirror of {full_name} unusable ({e}), reading the remote tree")
+
+    head, _ = await gh.get_head(full_name, "main")
+    if code is not None:
+        return code, set(head["files"])
+    sha = head["files"].get("index.html")
+    schedule_mirror_refresh(full_name, repo["clone_url"])
+    await record_job_stats(previous_code_source="remote")
+    if sha is None:
+        return None, set(head["files"])
+    blob = await gh.request("GET", f"/repos/{full_name}/git/blobs/{sha}")
+    log(f"📥 Previous code of {full_name} read from the remote tree at {head['commit'][:8]}")
+    return base64.b64decode(blob["content"]).decode("utf-8", errors="replace"), set(head["files"])
+
+
+def collect_files_to_push(app_folder, task_name, repo_url, brief):
+    """
+    Read every file in app_folder plus the generated README and LICENSE.
+    Text files are returned as str, binary files as bytes.
+    """
+    files_to_push = []
+
+    # Push index.html
+    index_path = os.path.join(app_folder, "index.html")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            html_content = f.read()
+        files_to_push.append({"path": "index.html", "content": html_content})
+        log("✅ Added index.html to push list")
+
+    # 🆕 PUSH ALL ATTACHMENT FILES (markdown, csv, json, etc.)
+    for filename in os.listdir(app_folder):
+        if filename != "index.html":  # Skip index.html since we already handle it
+            file_path = os.path.join(app_folder, filename)
+            if os.path.isfile(file_path):
+                try:
+                    # Read file content based on file type
+                    if filename.endswith(('.md', '.txt', '.csv', '.json', '.js', '.css', '.html')):
+                        # Text files
+                        with open(file_path, "r", encoding="utf-8") as f:
+                            file_content = f.read()
+                        files_to_push.append({"path": filename, "content": file_content})
+                        log(f"✅ Added text file: {filename}")
+                    else:
+                        # Binary files (images, etc.) are pushed as raw bytes
+                        with open(file_path, "rb") as f:
+                            file_bytes = f.read()
+                        files_to_push.append({"path": filename, "content": file_bytes})
+                        log(f"✅ Added binary file: {filename}")
+                except Exception as e:
+                    log(f"⚠️ Failed to process {filename}: {e}")
+
+    # Generate README content
+    readme_content = generate_readme_content(brief, task_name, repo_url, "MIT License")
+    files_to_push.append({"path": "README.md", "content": readme_content})
+    log("✅ Generated README.md content")
+
+    # Add LICENSE
+    files_to_push.append({"path": "LICENSE", "content": get_license_text()})
+    log("✅ Added LICENSE content")
+
+    return files_to_push
+
+
+async def create_or_update_repo(app_folder, task_name, round_number, brief):
     """
     Create or update a GitHub repo for the task.
     Pushes ALL files including attachments.
     """
-    from github import Github, Auth
-    import base64
-    import requests
-    import time
-
     try:
-        g = Github(auth=Auth.Token(GITHUB_TOKEN))
-        user = g.get_user()
+        gh = get_github_api()
+        user = await gh.get_user()
 
         # Create or get repo
         try:
-            repo = user.get_repo(task_name)
+            repo = await gh.get_repo(user["login"], task_name)
             is_new_repo = False
-            print(f"✅ Found existing repo: {repo.full_name}")
-        except:
-            repo = user.create_repo(
-                task_name,
-                description=f"Auto-generated: {brief[:100]}...",
-                private=False,
-                auto_init=True
-            )
+            log(f"✅ Found existing repo: {repo['full_name']}")
+        except GitHubError as e:
+            if e.status != 404:
+                raise
+            repo = await gh.request("POST", "/user/repos", json={
+                "name": task_name,
+                "description": f"Auto-generated: {brief[:100]}...",
+                "private": False,
+                "auto_init": True
+            })
+            gh.remember_repo(repo)
             is_new_repo = True
-            print(f"✅ Created new repo: {repo.full_name}")
+            log(f"✅ Created new repo: {repo['full_name']}")
 
         # 🆕 PUSH ALL FILES IN THE APP FOLDER
-        files_to_push = []
-
-        # Push index.html
-        index_path = os.path.join(app_folder, "index.html")
-        if os.path.exists(index_path):
-            with open(index_path, "r", encoding="utf-8") as f:
-                html_content = f.read()
-            files_to_push.append({"path": "index.html", "content": html_content})
-            print("✅ Added index.html to push list")
-
-        # 🆕 PUSH ALL ATTACHMENT FILES (markdown, csv, json, etc.)
-        for filename in os.listdir(app_folder):
-            if filename != "index.html":  # Skip index.html since we already handle it
-                file_path = os.path.join(app_folder, filename)
-                if os.path.isfile(file_path):
-                    try:
-                        # Read file content based on file type
-                        if filename.endswith(('.md', '.txt', '.csv', '.json', '.js', '.css', '.html')):
-                            # Text files
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                file_content = f.read()
-                            files_to_push.append({"path": filename, "content": file_content})
-                            print(f"✅ Added text file: {filename}")
-                        else:
-                            # Binary files (images, etc.)
-                            with open(file_path, "rb") as f:
-                                file_bytes = f.read()
-                            file_b64 = base64.b64encode(file_bytes).decode('utf-8')
-                            
-                            # Use GitHub API for binary files
-                            try:
-                                existing_file = repo.get_contents(filename)
-                                sha = existing_file.sha
-                            except:
-                                sha = None
-
-                            data = {
-                                "message": f"Round {round_number} - Add/Update {filename}",
-                                "content": file_b64,
-                                "branch": "main"
-                            }
-                            if sha:
-                                data["sha"] = sha
-
-                            repo._requester.requestJson(
-                                "PUT",
-                                f"/repos/{repo.owner.login}/{repo.name}/contents/{filename}",
-                                input=data
-                            )
-                            print(f"✅ Added/updated binary file: {filename}")
-                    except Exception as e:
-                        print(f"⚠️ Failed to process {filename}: {e}")
-
-        # Generate README content
-        repo_url = f"https://github.com/{user.login}/{task_name}"
-        readme_content = generate_readme_content(brief, task_name, repo_url, "MIT License")
-        files_to_push.append({"path": "README.md", "content": readme_content})
-        print("✅ Generated README.md content")
-
-        # Add LICENSE
-        files_to_push.append({"path": "LICENSE", "content": LICENSE_TEMPLATE})
-        print("✅ Added LICENSE content")
-
-        # Push all text files
-        commit_sha = None
-        for file_info in files_to_push:
-            file_path = file_info["path"]
-            file_content = file_info["content"]
-            try:
-                existing_file = repo.get_contents(file_path, ref="main")
-                commit = repo.update_file(
-                    file_path,
-                    f"Round {round_number} - Update {file_path}",
-                    file_content,
-                    existing_file.sha,
-                    branch="main"
-                )
-                print(f"✅ Updated file: {file_path}")
-            except:
-                commit = repo.create_file(
-                    file_path,
-                    f"Round {round_number} - Add {file_path}",
-                    file_content,
-                    branch="main"
-                )
-                print(f"✅ Created file: {file_path}")
-            commit_sha = commit["commit"].sha
+        repo_url = f"https://github.com/{user['login']}/{task_name}"
+        files_to_push = await asyncio.to_thread(
+            collect_files_to_push, app_folder, task_name, repo_url, brief
+        )
+
+        # Push all files
+        if GITHUB_PUSH_MODE == "contents":
+            commit_sha = await push_files_simple(gh, repo, files_to_push, round_number, is_new_repo)
+            gh.forget_head(repo["full_name"], "main")
+        else:
+            commit_sha, push_stats = await push_files_atomic(gh, repo, files_to_push, round_number)
+            await record_job_stats(**push_stats)
+            log(
+                f"📊 Push stats: uploaded {push_stats['uploaded_files']} files "
+                f"({push_stats['uploaded_bytes']} bytes), skipped {push_stats['skipped_files']} "
+                f"unchanged files ({push_stats['skipped_bytes']} bytes)"
+            )
+
+        schedule_mirror_refresh(repo["full_name"], repo["clone_url"])
 
         # Enable GitHub Pages
-        pages_url = enable_github_pages(repo)
+        pages_url = await enable_github_pages(gh, repo)
 
-        return repo.clone_url, pages_url, commit_sha
+        return repo["full_name"], repo["clone_url"], pages_url, commit_sha
 
     except Exception as e:
-        print(f"❌ GitHub operation failed: {e}")
+        log(f"❌ GitHub operation failed: {e}")
         raise Exception(f"GitHub operation failed: {e}")
 
-def push_files_simple(repo, files, round_number, is_new_repo):
-    """Simple file pushing using create_file/update_file methods"""
-    from github import GithubException
-    
+def git_blob_sha(data):
+    """Compute the git blob SHA-1 of raw bytes, exactly as `git hash-object` does."""
+    import hashlib
+
+    header = f"blob {len(data)}\0".encode("utf-8")
+    return hashlib.sha1(header + data).hexdigest()
+
+
+async def push_files_atomic(gh, repo, files, round_number, branch="main"):
+    """
+    Push all files as ONE commit using the Git Data API.
+    Compares against the remote tree (cached from the previous push when
+    possible) and only uploads files whose git blob SHA differs; if nothing
+    changed no commit is made at all.
+    Returns (head_commit_sha, push_stats).
+    """
+    full_name = repo["full_name"]
+    log(f"📁 Pushing {len(files)} files to repo {repo['name']} as a single commit")
+
+    for attempt in (1, 2):
+        head, from_cache = await gh.get_head(full_name, branch)
+        try:
+            return await push_onto_head(gh, full_name, head, files, round_number, branch)
+        except GitHubError as e:
+            # A cached head that someone else moved makes the ref update non-fast-forward
+            if from_cache and attempt == 1 and e.status in (409, 422):
+                log(f"⚠️ Cached head of {full_name} is stale ({e}), refreshing")
+                gh.forget_head(full_name, branch)
+                continue
+            raise
+
+
+async def push_onto_head(gh, full_name, head, files, round_number, branch):
+    """Create the changed blobs, one tree and one commit on top of head, then move the ref"""
+    repo_path = f"/repos/{full_name}"
+    remote_shas = head["files"]
+
+    push_stats = {"uploaded_files": 0, "uploaded_bytes": 0, "skipped_files": 0, "skipped_bytes": 0}
+    changed_files = []
+    for file_info in files:
+        file_path = file_info["path"]
+        file_content = file_info["content"]
+        data = file_content if isinstance(file_content, bytes) else file_content.encode("utf-8")
+
+        if remote_shas.get(file_path) == git_blob_sha(data):
+            push_stats["skipped_files"] += 1
+            push_stats["skipped_bytes"] += len(data)
+            log(f"⏭️ Unchanged, skipping: {file_path}")
+            continue
+
+        changed_files.append((file_path, data))
+        push_stats["uploaded_files"] += 1
+        push_stats["uploaded_bytes"] += len(data)
+
+    if not changed_files:
+        log(f"✅ Nothing changed, keeping {branch} at {head['commit'][:8]}")
+        return head["commit"], push_stats
+
+    async def upload_blob(file_path, data):
+        blob = await gh.request("POST", f"{repo_path}/git/blobs", json={
+            "content": base64.b64encode(data).decode("utf-8"),
+            "encoding": "base64"
+        })
+        log(f"✅ Created blob: {file_path}")
+        return {"path": file_path, "mode": "100644", "type": "blob", "sha": blob["sha"]}
+
+    # Blobs are independent, so upload them concurrently
+    tree_elements = await asyncio.gather(*(upload_blob(path, data) for path, data in changed_files))
+
+    tree = await gh.request("POST", f"{repo_path}/git/trees", json={
+        "base_tree": head["tree"],
+        "tree": list(tree_elements)
+    })
+    commit = await gh.request("POST", f"{repo_path}/git/commits", json={
+        "message": f"Round {round_number} - Update {len(tree_elements)} files",
+        "tree": tree["sha"],
+        "parents": [head["commit"]]
+    })
+    await gh.request("PATCH", f"{repo_path}/git/refs/heads/{branch}", json={"sha": commit["sha"]})
+    log(f"✅ Moved {branch} to commit {commit['sha'][:8]}")
+
+    # The next round of this task can start from here without re-reading the remote
+    files_after = dict(remote_shas)
+    files_after.update({element["path"]: element["sha"] for element in tree_elements})
+    gh.remember_head(full_name, branch, {"commit": commit["sha"], "tree": tree["sha"], "files": files_after})
+
+    return commit["sha"], push_stats
+
+
+async def push_files_simple(gh, repo, files, round_number, is_new_repo):
+    """Simple file pushing, one Contents API commit per file"""
+    repo_path = f"/repos/{repo['full_name']}"
+
     commit_sha = None
-    print(f"📁 Pushing {len(files)} files to repo {repo.name} (new repo: {is_new_repo})")
+    log(f"📁 Pushing {len(files)} files to repo {repo['name']} (new repo: {is_new_repo})")
     
     for file_info in files:
         try:
             file_path = file_info["path"]
             file_content = file_info["content"]
+            data = file_content if isinstance(file_content, bytes) else file_content.encode("utf-8")
+            payload = {
+                "message": f"Round {round_number} - Add {file_path}",
+                "content": base64.b64encode(data).decode("utf-8"),
+                "branch": "main"
+            }
             
-            # Try to get the file to see if it exists
+            # Try to get the file to see if it exists.
+            # Only a 404 means "create"; rate limits are retried inside gh.request
             try:
-                existing_file = repo.get_contents(file_path, ref="main")
-                # File exists - update it
-                commit = repo.update_file(
-                    file_path,
-                    f"Round {round_number} - Update {file_path}",
-                    file_content,
-                    existing_file.sha,
-                    branch="main"
-                )
-                print(f"✅ Updated file: {file_path}")
-                
-            except GithubException as e:
-                if e.status == 404:
-                    # File doesn't exist - create it
-                    commit = repo.create_file(
-                        file_path,
-                        f"Round {round_number} - Add {file_path}",
-                        file_content,
-                        branch="main"
-                    )
-                    print(f"✅ Created file: {file_path}")
-                else:
-                    print(f"❌ GitHub error for {file_path}: {e}")
+                existing_file = await gh.request("GET", f"{repo_path}/contents/{file_path}", params={"ref": "main"})
+            except GitHubError as e:
+                if e.status != 404:
                     raise
-                    
-            except Exception as e:
-                # File doesn't exist - create it
-                commit = repo.create_file(
-                    file_path,
-                    f"Round {round_number} - Add {file_path}",
-                    file_content,
-                    branch="main"
-                )
-                print(f"✅ Created file: {file_path}")
+                existing_file = None
+
+            if existing_file:
+                # File exists - update it
+                payload["message"] = f"Round {round_number} - Update {file_path}"
+                payload["sha"] = existing_file["sha"]
+            commit = await gh.request("PUT", f"{repo_path}/contents/{file_path}", json=payload)
+            log(f"✅ {'Updated' if existing_file else 'Created'} file: {file_path}")
             
-            commit_sha = commit["commit"].sha
-            print(f"   Commit SHA: {commit_sha[:8]}")
+            commit_sha = commit["commit"]["sha"]
+            log(f"   Commit SHA: {commit_sha[:8]}")
             
         except Exception as file_error:
-            print(f"❌ Failed to process {file_info['path']}: {file_error}")
-            # Continue with other files even if one fails
-            continue
+            # A missing file would publish a broken page, so fail the push
+            log(f"❌ Failed to process {file_info['path']}: {file_error}")
+            raise
     
     return commit_sha if commit_sha else "unknown_commit_sha"
 
 
-def enable_github_pages(repo):
-    """Enable GitHub Pages with synchronous verification"""
-    import requests
-    import time
-    
-    pages_url = f"https://{repo.owner.login}.github.io/{repo.name}/"
+async def enable_github_pages(gh, repo):
+    """Enable GitHub Pages for the repo and return its URL"""
+    pages_url = f"https://{repo['owner']['login']}.github.io/{repo['name']}/"
+    if gh.pages_cache.get(repo["full_name"]):
+        return pages_url
     
     # Enable Pages via API
-    pages_api_url = f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/pages"
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github+json"
-    }
+    pages_api_path = f"/repos/{repo['full_name']}/pages"
     payload = {
         "source": {
             "branch": "main",
@@ -331,44 +1782,74 @@ def enable_github_pages(repo):
     }
     
     try:
-        response = requests.post(pages_api_url, json=payload, headers=headers, timeout=10)
-        if response.status_code in [201, 202]:
-            print("✅ GitHub Pages enabled successfully")
-        elif response.status_code == 409:
-            print("✅ GitHub Pages already enabled")
+        await gh.request("POST", pages_api_path, json=payload)
+        gh.pages_cache.put(repo["full_name"], True)
+        log("✅ GitHub Pages enabled successfully")
+    except GitHubError as e:
+        if e.status == 409:
+            gh.pages_cache.put(repo["full_name"], True)
+            log("✅ GitHub Pages already enabled")
         else:
             # Check if already enabled
             try:
-                status_response = requests.get(pages_api_url, headers=headers, timeout=5)
-                if status_response.status_code == 200:
-                    print("✅ GitHub Pages already enabled")
-                else:
-                    print(f"⚠️ GitHub Pages enable returned: {response.status_code}")
+                await gh.request("GET", pages_api_path)
+                gh.pages_cache.put(repo["full_name"], True)
+                log("✅ GitHub Pages already enabled")
+            except GitHubError:
+                log(f"⚠️ GitHub Pages enable returned: {e.status}")
             except Exception as status_e:
-                print(f"⚠️ Error checking Pages status: {status_e}")
+                log(f"⚠️ Error checking Pages status: {status_e}")
     except Exception as e:
-        print(f"⚠️ Error enabling GitHub Pages: {e}")
+        log(f"⚠️ Error enabling GitHub Pages: {e}")
         # Continue anyway - return the URL and let evaluators handle it
     
-    # SYNCHRONOUS VERIFICATION - wait up to 30 seconds for Pages to be live
-    print(f"🔄 Checking GitHub Pages deployment: {pages_url}")
-    max_attempts = 6  # 6 attempts * 5 seconds = 30 seconds max
-    for attempt in range(max_attempts):
+    # Readiness is tracked separately against the Pages build of the pushed commit
+    return pages_url
+
+
+async def wait_for_pages_build(repo_full_name, commit_sha):
+    """
+    Poll the Pages builds API until the build for commit_sha is live.
+    Backs off between polls and gives up at PAGES_DEADLINE.
+    Returns True when the build for this commit is live.
+    """
+    # Contents mode may not know the final commit; then any finished build counts
+    exact_commit = commit_sha and commit_sha != "unknown_commit_sha"
+    delay = PAGES_POLL_INTERVAL
+    deadline = time.monotonic() + PAGES_DEADLINE
+    log(f"🔄 Waiting for Pages build of {repo_full_name}@{(commit_sha or '')[:8]}")
+
+    gh = get_github_api()
+    compared = set()
+    while True:
         try:
-            response = requests.get(pages_url, timeout=5)
-            if response.status_code == 200:
-                print(f"✅ GitHub Pages CONFIRMED LIVE (attempt {attempt + 1})")
-                return pages_url
-            else:
-                print(f"⏳ Pages status: {response.status_code} (attempt {attempt + 1})")
-        except requests.exceptions.RequestException as e:
-            print(f"⏳ Pages not accessible yet (attempt {attempt + 1}): {e}")
-        
-        if attempt < max_attempts - 1:  # Don't sleep after last attempt
-            time.sleep(5)  # Wait 5 seconds between checks
-    
-    print(f"⚠️ GitHub Pages not confirmed after {max_attempts} attempts, but URL: {pages_url}")
-    return pages_url  # Return URL anyway
+            build = await gh.request("GET", f"/repos/{repo_full_name}/pages/builds/latest")
+            status = build.get("status")
+            built_commit = build.get("commit") or ""
+            if not exact_commit or built_commit == commit_sha:
+                if status == "built":
+                    log(f"✅ GitHub Pages build for {built_commit[:8]} is LIVE")
+                    return True
+                if status == "errored":
+                    log(f"⚠️ GitHub Pages build for {built_commit[:8]} errored: {build.get('error')}")
+                    return False
+            elif status == "built" and built_commit and built_commit not in compared:
+                # A later round of the same task may already have been pushed and built
+                compared.add(built_commit)
+                comparison = await gh.request("GET", f"/repos/{repo_full_name}/compare/{commit_sha}...{built_commit}")
+                if comparison.get("status") == "ahead":
+                    log(f"✅ GitHub Pages build {built_commit[:8]} already includes {commit_sha[:8]}")
+                    return True
+            log(f"⏳ Pages build {status} for {built_commit[:8]}")
+        except (GitHubError, httpx.HTTPError) as e:
+            log(f"⏳ Pages build not available yet: {e}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            log(f"⚠️ Pages build for {(commit_sha or '')[:8]} not live after {PAGES_DEADLINE:.0f}s")
+            return False
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * PAGES_POLL_BACKOFF, PAGES_POLL_MAX_INTERVAL)
 
 
 def generate_readme_content(brief, task_name, repo_url, license_text, previous_readme=None, attachments=None):
@@ -406,38 +1887,649 @@ This project was automatically generated based on the following requirement:
 
 
 
-def generate_code_from_brief(brief, attachments=None, previous_code=None, checks=None, seed=None):
+# --- Token-budgeted prompt assembly ---
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "24000"))
+# Blocks of previous code smaller than this are never elided
+ELIDE_MIN_CHARS = int(os.environ.get("ELIDE_MIN_CHARS", "600"))
+
+# Placeholder for the previous code while the rest of the prompt is measured
+PREVIOUS_CODE_SLOT = "\x00PREVIOUS_CODE\x00"
+
+ELIDABLE_PATTERNS = [
+    # Inline base64 payloads (images, fonts)
+    re.compile(r"data:[\w/+.-]+;base64,[A-Za-z0-9+/=\s]+"),
+    # Inline CSS
+    re.compile(r"(?<=>)[^<]+(?=</style>)", re.IGNORECASE),
+    # Inline SVG artwork
+    re.compile(r"<svg\b.*?</svg>", re.IGNORECASE | re.DOTALL),
+    # Embedded JSON data blocks
+    re.compile(r"(?<=<script type=\"application/json\">)[^<]+(?=</script>)", re.IGNORECASE),
+    # Long numeric data arrays and long string literals in scripts
+    re.compile(r"\[[\d\s.,\-eE]+\]"),
+    re.compile(r"\"[^\"\n]{2000,}\"|'[^'\n]{2000,}'|`[^`]{2000,}`"),
+]
+
+_token_encoder = None
+
+
+def count_tokens(text):
+    """Token count via tiktoken when it is installed, otherwise ~4 chars per token"""
+    global _token_encoder
+    if _token_encoder is None:
+        try:
+            import tiktoken
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _token_encoder = False
+    if _token_encoder:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def elide_previous_code(previous_code, max_tokens):
     """
-    Generates HTML+JS for ANY task - completely generic
+    Shrink previous_code to max_tokens by swapping the largest non-essential
+    blocks (inline CSS, data URIs, SVGs, data literals) for placeholders.
+    Returns (compacted_code, elided_blocks) where elided_blocks maps each
+    placeholder back to its original text.
     """
-    
-    # Prepare context - KEEP THIS GENERIC
-    attach_text = ""
-    if attachments:
-        attach_text = "Attachments available:\n" + "\n".join(
-            [f"- {a.get('name', a.get('filename', 'file'))}" for a in attachments]
+    elided_blocks = {}
+    if count_tokens(previous_code) <= max_tokens:
+        return previous_code, elided_blocks
+    if max_tokens <= 0:
+        # No budget left at all, so not even a head and tail fit: drop the previous code
+        log(f"⚠️ No prompt budget left for previous code ({max_tokens} tokens), leaving it out")
+        return "<!-- previous code omitted: the rest of the prompt fills the budget -->", elided_blocks
+
+    candidates = []
+    for pattern in ELIDABLE_PATTERNS:
+        for match in pattern.finditer(previous_code):
+            if len(match.group(0)) >= ELIDE_MIN_CHARS:
+                candidates.append(match.group(0))
+    # Largest blocks first, each distinct block once
+    candidates = sorted(set(candidates), key=len, reverse=True)
+
+    compacted = previous_code
+    for block in candidates:
+        if count_tokens(compacted) <= max_tokens:
+            break
+        if block not in compacted:
+            continue  # Already inside a larger elided block
+        marker = f"__ELIDED_BLOCK_{len(elided_blocks)}__"
+        elided_blocks[marker] = block
+        compacted = compacted.replace(block, marker)
+
+    if count_tokens(compacted) > max_tokens:
+        # Last resort: keep the head and tail of the page
+        keep_chars = max_tokens * 2
+        compacted = (
+            compacted[:keep_chars] +
+            "\n<!-- ... middle of previous code omitted to fit the prompt budget ... -->\n" +
+            compacted[-keep_chars:]
         )
+    return compacted, elided_blocks
 
-    checks_text = ""
-    if checks:
-        checks_text = "\nEvaluation checks that MUST pass:\n" + "\n".join([f"- {check}" for check in checks])
 
-    previous_code_text = ""
-    if previous_code:
-        previous_code_text = f"\nPrevious code (modify this):\n{previous_code}"
+def fit_previous_code(prompt, previous_code, token_budget):
+    """
+    Fill PREVIOUS_CODE_SLOT in prompt with as much of previous_code as the
+    budget allows. Returns (prompt, elided_blocks).
+    """
+    base_tokens = count_tokens(prompt.replace(PREVIOUS_CODE_SLOT, ""))
+    compacted, elided_blocks = elide_previous_code(previous_code, token_budget - base_tokens)
+
+    previous_code_text = f"\nPrevious code (modify this):\n{compacted}"
+    if elided_blocks:
+        previous_code_text += (
+            "\nNOTE: Large unchanged blocks were replaced by placeholders like __ELIDED_BLOCK_0__. "
+            "Keep every placeholder exactly as written wherever that content should remain; "
+            "each one is expanded back to the original content after generation."
+        )
+    return prompt.replace(PREVIOUS_CODE_SLOT, previous_code_text), elided_blocks
 
-    seed_text = f"\nSeed value: {seed}" if seed else ""
 
-    # 🆕 ENHANCED PROMPT - prevents hardcoded solutions
-    prompt = f"""
-You are an expert web developer. Generate a complete, self-contained HTML+JavaScript web application.
-TASK REQUIREMENT:
-{brief}
-ADDITIONAL CONTEXT:
-{attach_text if attachments else "No attachments"}
-{checks_text if checks else "No specific checks"}
-{previous_code_text if previous_code else "No previous code"}
-{seed_text if seed else "No seed"}
+def restore_elided(html_code, elided_blocks):
+    """Expand placeholders left in generated code back to the original blocks"""
+    for marker, block in elided_blocks.items():
+        if marker not in html_code:
+            log(f"⚠️ Generated code dropped {marker}; its original content is lost")
+            continue
+        html_code = html_code.replace(marker, block)
+    return html_code
+
+
+# --- Streaming generation ---
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "1") == "1"
+LLM_STREAM_RETRIES = int(os.environ.get("LLM_STREAM_RETRIES", "2"))
+LLM_MAX_OUTPUT_CHARS = int(os.environ.get("LLM_MAX_OUTPUT_CHARS", "300000"))
+# Ask for token usage in the final stream chunk; turn off for providers that reject stream_options
+LLM_STREAM_USAGE = os.environ.get("LLM_STREAM_USAGE", "1") == "1"
+# Characters of output to look at before deciding whether the stream is HTML
+LLM_SNIFF_CHARS = 64
+# Per-call deadlines: until the first streamed token, and for the whole call
+LLM_FIRST_TOKEN_TIMEOUT = float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "60"))
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "300"))
+# Send a backup request when the first token (whole response when not streaming) takes
+# longer than this percentile of recent calls to the model; 0 disables hedging
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Tried in order after LLM_MODEL fails, e.g. "gpt-4o,gpt-4.1-mini"
+LLM_FALLBACK_MODELS = [m.strip() for m in os.environ.get("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Consecutive endpoint failures that open a model's circuit, and seconds before one trial call
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class GenerationAborted(Exception):
+    """Streamed output was clearly not a usable HTML page"""
+
+
+class GenerationFailed(Exception):
+    """No model in the LLM chain produced a page"""
+
+
+class LatencyWindow:
+    """Latencies of the most recent calls to one model"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        """None until LLM_HEDGE_MIN_SAMPLES calls have been seen"""
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * q / 100), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Opens after LLM_BREAKER_FAILURES consecutive endpoint failures. While open,
+    calls are refused; after LLM_BREAKER_COOLDOWN one trial call is let through
+    and its outcome closes or re-opens the circuit. State is per process.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < LLM_BREAKER_COOLDOWN:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.opened_at is not None or self.failures >= LLM_BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+
+
+llm_latencies = defaultdict(LatencyWindow)
+llm_breakers = defaultdict(CircuitBreaker)
+# Per-batch caps on LLM slots; an entry lives while jobs of the batch hold or wait for it
+batch_llm_semaphores = weakref.WeakValueDictionary()
+
+
+def batch_llm_semaphore():
+    """The current job's batch semaphore, or None outside batch submissions"""
+    batch_id = current_batch_id.get()
+    if batch_id is None:
+        return None
+    semaphore = batch_llm_semaphores.get(batch_id)
+    if semaphore is None:
+        semaphore = batch_llm_semaphores[batch_id] = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    return semaphore
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Hold an llm_semaphore slot; jobs of a batch first take one of BATCH_LLM_CONCURRENCY batch slots"""
+    batch_semaphore = batch_llm_semaphore()
+    if batch_semaphore is None:
+        async with llm_semaphore:
+            yield
+    else:
+        async with batch_semaphore, llm_semaphore:
+            yield
+
+
+def llm_slot_free():
+    batch_semaphore = batch_llm_semaphore()
+    return not llm_semaphore.locked() and (batch_semaphore is None or not batch_semaphore.locked())
+
+
+def is_endpoint_failure(error):
+    """Timeouts, connection errors, 429 and 5xx; not bad requests or unusable output"""
+    import openai
+    if isinstance(error, (TimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+async def hedged_call(model, attempt):
+    """
+    Run attempt(on_first_token). If it has produced nothing after the model's
+    LLM_HEDGE_PERCENTILE latency, start one identical backup attempt (only when
+    an LLM slot is free). The first attempt to produce a token wins and the
+    other is cancelled; for non-streaming attempts the first response wins.
+    """
+    tasks = []
+    committed = False
+
+    def on_first_token():
+        nonlocal committed
+        committed = True
+        for task in tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    async def run():
+        try:
+            result = await attempt(on_first_token)
+        except asyncio.CancelledError:
+            LLM_REQUESTS.labels(model, "cancelled").inc()
+            raise
+        except TimeoutError:
+            LLM_REQUESTS.labels(model, "timeout").inc()
+            raise
+        except GenerationAborted:
+            LLM_REQUESTS.labels(model, "aborted").inc()
+            raise
+        except Exception:
+            LLM_REQUESTS.labels(model, "error").inc()
+            raise
+        LLM_REQUESTS.labels(model, "ok").inc()
+        return result
+
+    tasks.append(asyncio.create_task(run()))
+    try:
+        hedge_after = llm_latencies[model].percentile(LLM_HEDGE_PERCENTILE) if LLM_HEDGE_PERCENTILE else None
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and not committed:
+                if not llm_slot_free():
+                    log(f"⏳ {model} slower than p{LLM_HEDGE_PERCENTILE:g} ({hedge_after:.1f}s), no free slot to hedge")
+                else:
+                    log(f"🪁 {model} slower than p{LLM_HEDGE_PERCENTILE:g} ({hedge_after:.1f}s), sending a backup request")
+                    tasks.append(asyncio.create_task(run()))
+                    await record_job_stats(llm_hedged=True)
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        LLM_HEDGES.labels("primary" if task is tasks[0] else "backup").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let the losers close their streams and release their LLM slots
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class FenceStripper:
+    """
+    Removes a leading ``` / ```html fence and a trailing ``` fence from
+    streamed text without waiting for the whole response.
+    """
+
+    # Enough to hold a closing fence plus surrounding whitespace
+    TAIL_CHARS = 16
+
+    def __init__(self):
+        self.head = ""
+        self.started = False
+        self.tail = ""
+
+    def feed(self, text):
+        """Return the part of text that is safe to emit now"""
+        if not self.started:
+            self.head += text
+            stripped = self.head.lstrip()
+            if not stripped:
+                return ""
+            if stripped.startswith("`") and len(stripped) < 7 and "\n" not in stripped:
+                return ""  # Could still become ```html
+            if stripped.startswith("```html"):
+                stripped = stripped[7:]
+            elif stripped.startswith("```"):
+                stripped = stripped[3:]
+            self.started = True
+            text = stripped
+        if not self.tail:
+            # Nothing emitted yet: drop whitespace left after the opening fence
+            text = text.lstrip()
+        self.tail += text
+        if len(self.tail) <= self.TAIL_CHARS:
+            return ""
+        ready = self.tail[:-self.TAIL_CHARS]
+        self.tail = self.tail[-self.TAIL_CHARS:]
+        return ready
+
+    def finish(self):
+        """Return whatever is held back, minus a closing fence"""
+        tail = (self.tail if self.started else self.head.lstrip()).rstrip()
+        if tail.endswith("```"):
+            tail = tail[:-3].rstrip()
+        return tail
+
+
+def check_html_start(html_code):
+    """Raise GenerationAborted when output does not open like an HTML document"""
+    start = html_code.lstrip()[:16].lower()
+    if not start.startswith(("<!doctype", "<html", "<!--")):
+        raise GenerationAborted(f"output does not start with <!DOCTYPE/<html: {start!r}")
+
+
+def write_generated_html(output_path, html_code):
+    """Atomically replace output_path with html_code and drop any partial file"""
+    if output_path:
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(html_code)
+        os.replace(tmp_path, output_path)
+        if os.path.exists(f"{output_path}.partial"):
+            os.remove(f"{output_path}.partial")
+    return html_code
+
+
+async def record_llm_usage(usage):
+    """Add a response's prompt / cached / completion tokens to the job stats and metrics"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    tokens = {
+        "prompt": usage.prompt_tokens or 0,
+        "cached": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+        "completion": usage.completion_tokens or 0
+    }
+    for kind, count in tokens.items():
+        LLM_TOKENS.labels(kind).inc(count)
+    log(f"🧮 Tokens: {tokens['prompt']} prompt ({tokens['cached']} cached), {tokens['completion']} completion")
+    job_id = current_job_id.get()
+    if job_id:
+        await asyncio.to_thread(
+            get_job_store().add_stats, job_id, **{f"llm_{kind}_tokens": count for kind, count in tokens.items()}
+        )
+
+
+async def stream_attempt(request_params, partial_path, on_first_token):
+    """
+    One streamed completion within the per-call deadlines. Fences are stripped
+    on the fly and, from the first token on, the output is written to
+    partial_path. Returns (html, seconds to first token, usage).
+    """
+    ttfb = None
+    stripper = FenceStripper()
+    parts = []
+    size = 0
+    validated = False
+    usage = None
+    out = None
+    try:
+        async with llm_slot():
+            started = time.monotonic()
+            async with asyncio.timeout(LLM_FIRST_TOKEN_TIMEOUT) as deadline:
+                extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+                stream = await get_openai_client().chat.completions.create(**request_params, **extra, stream=True)
+                async with stream:
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        if ttfb is None:
+                            ttfb = time.monotonic() - started
+                            llm_latencies[request_params["model"]].add(ttfb)
+                            deadline.reschedule(asyncio.get_running_loop().time() - ttfb + LLM_CALL_TIMEOUT)
+                            on_first_token()
+                            if partial_path:
+                                out = open(partial_path, "w", encoding="utf-8")
+                        text = stripper.feed(delta)
+                        if not text:
+                            continue
+                        parts.append(text)
+                        size += len(text)
+                        if not validated and size >= LLM_SNIFF_CHARS:
+                            check_html_start("".join(parts))
+                            validated = True
+                        if size > LLM_MAX_OUTPUT_CHARS:
+                            raise GenerationAborted(f"output exceeded {LLM_MAX_OUTPUT_CHARS} chars")
+                        if out:
+                            out.write(text)
+
+        text = stripper.finish()
+        parts.append(text)
+        if out:
+            out.write(text)
+        html_code = "".join(parts)
+        if not validated:
+            check_html_start(html_code)
+        return html_code, ttfb, usage
+    finally:
+        if out:
+            out.close()
+
+
+async def stream_completion(request_params, partial_path=None):
+    """
+    Stream a chat completion (hedged, see hedged_call), retrying when the
+    output is not HTML or grows past LLM_MAX_OUTPUT_CHARS.
+    """
+    model = request_params["model"]
+    for attempt in range(1, LLM_STREAM_RETRIES + 2):
+        started = time.monotonic()
+        try:
+            html_code, ttfb, usage = await hedged_call(
+                model, lambda on_first_token: stream_attempt(request_params, partial_path, on_first_token)
+            )
+        except GenerationAborted as e:
+            log(f"⚠️ Aborted generation attempt {attempt}: {e}")
+            if attempt > LLM_STREAM_RETRIES:
+                raise
+            continue
+
+        total = time.monotonic() - started
+        log(f"✅ Streamed {len(html_code)} chars (TTFB {ttfb or 0:.2f}s, total {total:.2f}s, attempt {attempt})")
+        if ttfb is not None:
+            LLM_TTFB_SECONDS.labels(PROMPT_VERSION).observe(ttfb)
+        await record_llm_usage(usage)
+        await record_job_stats(
+            llm_ttfb_seconds=round(ttfb or 0, 3),
+            llm_total_seconds=round(total, 3),
+            llm_attempts=attempt
+        )
+        return html_code
+
+
+async def complete_once(request_params):
+    """Non-streaming completion (hedged, see hedged_call) with code fences removed"""
+    model = request_params["model"]
+
+    async def attempt(on_first_token):
+        async with llm_slot():
+            started = time.monotonic()
+            async with asyncio.timeout(LLM_CALL_TIMEOUT):
+                response = await get_openai_client().chat.completions.create(**request_params)
+            llm_latencies[model].add(time.monotonic() - started)
+            return response
+
+    started = time.monotonic()
+    response = await hedged_call(model, attempt)
+    await record_llm_usage(response.usage)
+    stripper = FenceStripper()
+    html_code = stripper.feed(response.choices[0].message.content.strip())
+    html_code += stripper.finish()
+    await record_job_stats(llm_total_seconds=round(time.monotonic() - started, 3), llm_attempts=1)
+    return html_code
+
+
+async def complete_with_fallback(request_params, partial_path=None):
+    """
+    Generate with request_params["model"], then with each of LLM_FALLBACK_MODELS,
+    skipping models whose circuit is open. Returns (html, model used); raises
+    GenerationFailed when every model failed.
+    """
+    models = [request_params["model"]] + [m for m in LLM_FALLBACK_MODELS if m != request_params["model"]]
+    errors = []
+    for model in models:
+        breaker = llm_breakers[model]
+        if not breaker.allow():
+            LLM_REQUESTS.labels(model, "skipped").inc()
+            errors.append(f"{model}: circuit open")
+            continue
+        if errors:
+            log(f"↪️ Falling back to {model}")
+        params = {**request_params, "model": model}
+        try:
+            if LLM_STREAMING:
+                html_code = await stream_completion(params, partial_path)
+            else:
+                html_code = await complete_once(params)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                breaker.failure()
+            else:
+                breaker.success()
+            reason = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            log(f"❌ {model} failed: {reason}")
+            errors.append(f"{model}: {reason}")
+            continue
+        breaker.success()
+        await record_job_stats(llm_model=model)
+        return html_code, model
+    raise GenerationFailed("; ".join(errors))
+
+
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4o-mini")
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "llm_cache")
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+LLM_CACHE_MAX_AGE = float(os.environ.get("LLM_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+LLM_CACHE_BYPASS = os.environ.get("LLM_CACHE_BYPASS", "0") == "1"
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache of generated HTML.
+    Keyed on a hash of the rendered prompt and model parameters; entries
+    older than max_age are ignored and the least recently used entries
+    are evicted once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(request_params):
+        import hashlib
+
+        canonical = json.dumps(request_params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.html")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                html_code = f.read()
+            # Touch so eviction is least-recently-used
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return html_code
+
+    def put(self, key, html_code):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(html_code)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then oldest entries until under max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        with self.lock:
+            for root, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    if not filename.endswith(".html"):
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if now - stat.st_mtime > self.max_age:
+                        self._remove(path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+llm_cache = LLMCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE)
+
+
+# Static generation rules, sent first as the system message so the provider's
+# prefix cache can reuse them across jobs. Bump PROMPT_VERSION on every edit.
+PROMPT_VERSION = "2"
+GENERATION_SYSTEM_PROMPT = """You are an expert web developer. Generate a complete, self-contained HTML+JavaScript web application.
 CRITICAL REQUIREMENTS:
 1. Single HTML file with inline CSS and JavaScript
 2. Must work entirely in browser (no server-side code)
@@ -447,7 +2539,7 @@ CRITICAL REQUIREMENTS:
 6. Include appropriate error handling
 🚨 **API CORRECT USAGE:**
 - GitHub API tokens: Use Authorization header, NOT URL parameters
-- CORRECT: headers = {{'Authorization': 'token YOUR_TOKEN'}}
+- CORRECT: headers = {'Authorization': 'token YOUR_TOKEN'}
 - WRONG: ?token=xxx in URL
 - Bootstrap: Include BOTH CSS and JS CDNs
 🚨 **VALIDATION CHECK:**
@@ -521,183 +2613,1073 @@ OUTPUT FORMAT:
 - The output should be directly usable as index.html.
 """
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+
+async def generate_code_from_brief(brief, attachments=None, previous_code=None, checks=None, seed=None,
+                                   use_cache=True, output_path=None):
+    """
+    Generates HTML+JS for ANY task - completely generic.
+    Identical prompts are served from the on-disk LLM cache unless use_cache is False.
+    When output_path is given the page is streamed to <output_path>.partial and
+    the final page is written to output_path. Raises GenerationFailed when no
+    model in the LLM chain produced a page.
+    """
+    
+    # Prepare context - KEEP THIS GENERIC
+    attach_text = ""
+    if attachments:
+        attach_text = "Attachments available:\n" + "\n".join(
+            [f"- {a.get('name', a.get('filename', 'file'))}" for a in attachments]
         )
-        html_code = response.choices[0].message.content.strip()
 
-        # Clean markdown code fences
-        if html_code.startswith("```html"):
-            html_code = html_code[7:]
-        elif html_code.startswith("```"):
-            html_code = html_code[3:]
-        if html_code.endswith("```"):
-            html_code = html_code[:-3]
+    checks_text = ""
+    if checks:
+        checks_text = "\nEvaluation checks that MUST pass:\n" + "\n".join([f"- {check}" for check in checks])
+
+    previous_code_text = ""
+    if previous_code:
+        # Filled in after the rest of the prompt is measured against the token budget
+        previous_code_text = PREVIOUS_CODE_SLOT
+
+    seed_text = f"\nSeed value: {seed}" if seed else ""
+
+    # Per-task part only; the fixed rules are the system prompt (GENERATION_SYSTEM_PROMPT)
+    prompt = f"""TASK REQUIREMENT:
+{brief}
+ADDITIONAL CONTEXT:
+{attach_text if attachments else "No attachments"}
+{checks_text if checks else "No specific checks"}
+{previous_code_text if previous_code else "No previous code"}
+{seed_text if seed else "No seed"}
+"""
+
+    elided_blocks = {}
+    if previous_code:
+        prompt, elided_blocks = fit_previous_code(
+            prompt, previous_code, PROMPT_TOKEN_BUDGET - count_tokens(GENERATION_SYSTEM_PROMPT)
+        )
+    prompt_tokens = count_tokens(GENERATION_SYSTEM_PROMPT) + count_tokens(prompt)
+    log(
+        f"🧮 Prompt size: ~{prompt_tokens} tokens "
+        f"(previous code: {count_tokens(previous_code) if previous_code else 0} tokens, "
+        f"{len(elided_blocks)} blocks elided)"
+    )
+    await record_job_stats(
+        prompt_tokens_estimate=prompt_tokens, elided_blocks=len(elided_blocks), prompt_version=PROMPT_VERSION
+    )
+
+    request_params = {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": GENERATION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.2
+    }
+    use_cache = use_cache and not LLM_CACHE_BYPASS
+    cache_key = llm_cache.key_for(request_params)
+    if use_cache:
+        cached_html = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached_html is not None:
+            log(f"⚡ LLM cache hit ({cache_key[:12]})")
+            await record_job_stats(llm_cache="hit")
+            return write_generated_html(output_path, restore_elided(cached_html, elided_blocks))
+        await record_job_stats(llm_cache="miss")
+
+    partial_path = f"{output_path}.partial" if output_path else None
+    html_code, model = await complete_with_fallback(request_params, partial_path)
+
+    # Cache the raw output: placeholders only make sense with this prompt's blocks.
+    # Output of a fallback model is not cached under the primary model's key.
+    if use_cache and model == LLM_MODEL:
+        await asyncio.to_thread(llm_cache.put, cache_key, html_code)
+    return write_generated_html(output_path, restore_elided(html_code, elided_blocks))
+
+
+
+# --- Static validation of generated pages ---
+HTML_VALIDATION = os.environ.get("HTML_VALIDATION", "1") == "1"
+# LLM repair rounds for problems that cannot be fixed mechanically
+HTML_REPAIR_ATTEMPTS = int(os.environ.get("HTML_REPAIR_ATTEMPTS", "1"))
+
+# The CDN builds the prompt prescribes:
+# (name, script pattern, stylesheet pattern, script, stylesheet, globals, both tags required).
+# Patterns match the library's own file under its own package path, so other builds
+# of that file are flagged but companion packages, plugins and themes are left alone.
+CDN_LIBRARIES = [
+    ("marked",
+     re.compile(r"/marked(?:@[^/]*)?/(?:[^?#]*/)?marked(?:\.umd|\.esm)?(?:\.min)?\.js(?:[?#]|$)", re.I), None,
+     "https://cdn.jsdelivr.net/npm/marked/marked.min.js", None, ("marked",), False),
+    ("highlight.js",
+     re.compile(r"/(?:highlight\.js|highlightjs/cdn-release|@highlightjs/cdn-assets)(?:@[^/]*)?/(?:[^?#]*/)?"
+                r"highlight(?:\.min)?\.js(?:[?#]|$)", re.I),
+     re.compile(r"/(?:highlight\.js|highlightjs/cdn-release|@highlightjs/cdn-assets)(?:@[^/]*)?/(?:[^?#]*/)?"
+                r"styles/github(?:\.min)?\.css(?:[?#]|$)", re.I),
+     "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/highlight.min.js",
+     "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/styles/github.min.css", ("hljs",), False),
+    ("bootstrap",
+     re.compile(r"/bootstrap(?:@[^/]*)?/(?:[^?#]*/)?bootstrap(?:\.bundle)?(?:\.min)?\.js(?:[?#]|$)", re.I),
+     re.compile(r"/bootstrap(?:@[^/]*)?/(?:[^?#]*/)?bootstrap(?:\.min)?\.css(?:[?#]|$)", re.I),
+     "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js",
+     "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css", ("bootstrap",), True),
+    ("tesseract.js",
+     re.compile(r"/tesseract\.js(?:@[^/]*)?/(?:[^?#]*/)?tesseract(?:\.min)?\.js(?:[?#]|$)", re.I), None,
+     "https://cdn.jsdelivr.net/npm/tesseract.js@2.1.5/dist/tesseract.min.js", None, ("Tesseract",), False),
+]
+DEPRECATED_MARKED_RE = re.compile(r"(?<![\w.$])marked\s*\(")
+FETCH_LITERAL_RE = re.compile(r"""fetch\(\s*(['"`])([^'"`]+)\1""")
+# Tags whose src/href load a file at page load
+ASSET_ATTRIBUTES = {"img": "src", "script": "src", "link": "href", "source": "src",
+                    "audio": "src", "video": "src", "iframe": "src", "embed": "src"}
+
+
+class PageInspector(HTMLParser):
+    """Collects external scripts/stylesheets, inline script text and local asset references"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.scripts = []
+        self.stylesheets = []
+        self.inline_js = []
+        self.assets = []
+        self.open_script = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "script":
+            self.open_script = True
+            if attrs.get("src"):
+                self.scripts.append(attrs["src"])
+        elif tag == "link" and "stylesheet" in (attrs.get("rel") or "").lower() and attrs.get("href"):
+            self.stylesheets.append(attrs["href"])
+        elif tag == "link" and "icon" in (attrs.get("rel") or "").lower():
+            return  # A missing favicon costs a 404, not a broken page
+        url = attrs.get(ASSET_ATTRIBUTES.get(tag, ""))
+        if url:
+            self.assets.append(url)
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self.open_script = False
+
+    def handle_data(self, data):
+        if self.open_script:
+            self.inline_js.append(data)
+
+
+def is_local_file_reference(url):
+    url = url.strip()
+    if not url or "${" in url or url.startswith(("#", "/", "data:", "blob:", "javascript:")) or "://" in url:
+        return False
+    return "." in os.path.basename(url.split("?")[0].split("#")[0])
+
+
+def find_page_problems(html_code, app_folder=None, attachment_names=(), repo_files=()):
+    """
+    Static checks of a generated page. Returns a list of (kind, detail, fix)
+    tuples; fix is None when only the LLM can repair the problem. Local
+    references may point at app_folder, the attachments or, for round 2,
+    the files already in the task's repo (repo_files).
+    """
+    inspector = PageInspector()
+    inspector.feed(html_code)
+    inspector.close()
+    problems = []
+    if inspector.open_script:
+        problems.append(("truncated", "the document ends inside a <script> element", None))
+
+    inline_js = "\n".join(inspector.inline_js)
+    for name, script_re, stylesheet_re, script_url, stylesheet_url, globals_used, both_required in CDN_LIBRARIES:
+        scripts = [url for url in inspector.scripts if script_re.search(url)]
+        stylesheets = [url for url in inspector.stylesheets if stylesheet_re and stylesheet_re.search(url)]
+        for url in scripts:
+            if url != script_url:
+                problems.append(("cdn", f"{name} script {url} instead of {script_url}", ("replace", url, script_url)))
+        for url in stylesheets:
+            if stylesheet_url and url != stylesheet_url:
+                problems.append(("cdn", f"{name} stylesheet {url} instead of {stylesheet_url}",
+                                 ("replace", url, stylesheet_url)))
+        uses_global = any(re.search(rf"\b{re.escape(g)}\s*[.(]", inline_js) for g in globals_used)
+        if not scripts and (uses_global or (both_required and stylesheets)):
+            problems.append(("missing-script", f"{name} is used but {script_url} is not loaded",
+                             ("add-script", script_url)))
+        if both_required and scripts and not stylesheets:
+            problems.append(("missing-stylesheet", f"{name} script is loaded without {stylesheet_url}",
+                             ("add-stylesheet", stylesheet_url)))
+
+    if DEPRECATED_MARKED_RE.search(inline_js):
+        problems.append(("marked", "marked(...) is removed in marked v4+, use marked.parse(...)", ("marked-parse",)))
+
+    known = {os.path.basename(name) for name in attachment_names if name}
+    references = inspector.assets + [match.group(2) for match in FETCH_LITERAL_RE.finditer(inline_js)]
+    missing = set()
+    for url in references:
+        if not is_local_file_reference(url):
+            continue
+        path = url.split("?")[0].split("#")[0]
+        if path.startswith("./"):
+            path = path[2:]
+        exists = (app_folder and os.path.exists(os.path.join(app_folder, path))) or path in repo_files
+        if not exists and os.path.basename(path) not in known:
+            missing.add(path)
+    for path in sorted(missing):
+        available = ", ".join(sorted(known)) or "none"
+        problems.append(("missing-file", f"references {path}, which does not exist (attachments: {available})", None))
+    return problems
+
+
+def apply_page_fixes(html_code, problems):
+    """Mechanical fixes: prescribed CDN URLs, marked.parse and missing tags"""
+    head_tags = []
+    body_tags = []
+    for _, _, fix in problems:
+        if fix is None:
+            continue
+        if fix[0] == "replace":
+            html_code = html_code.replace(fix[1], fix[2])
+        elif fix[0] == "marked-parse":
+            html_code = DEPRECATED_MARKED_RE.sub("marked.parse(", html_code)
+        elif fix[0] == "add-stylesheet":
+            head_tags.append(f'<link rel="stylesheet" href="{fix[1]}">')
+        elif fix[0] == "add-script":
+            body_tags.append(f'<script src="{fix[1]}"></script>')
+
+    def insert_before(html, marker, tags):
+        index = html.lower().find(marker)
+        if index < 0:
+            return None
+        return html[:index] + "\n".join(tags) + "\n" + html[index:]
+
+    if head_tags:
+        html_code = insert_before(html_code, "</head>", head_tags) or "\n".join(head_tags) + "\n" + html_code
+    if body_tags:
+        # Libraries have to load before the first inline script that uses them
+        html_code = (insert_before(html_code, "<script", body_tags)
+                     or insert_before(html_code, "</body>", body_tags)
+                     or html_code + "\n" + "\n".join(body_tags))
+    return html_code
+
+
+async def repair_generated_html(html_code, problems, attachment_names, output_path):
+    """Ask the LLM to fix only the listed problems instead of regenerating the page"""
+    listed = "\n".join(f"- {detail}" for _, detail, _ in problems)
+    files = ", ".join(name for name in attachment_names if name) or "none"
+    prompt = f"""The following single-file HTML application failed static checks before deployment.
+Fix ONLY these problems and keep everything else unchanged:
+{listed}
+Files available next to index.html: {files}
+Return ONLY the complete corrected HTML document (no markdown or explanation).
+
+{html_code}
+"""
+    request_params = {
+        "model": LLM_MODEL,
+        # Same system prefix as generation, so the provider's prompt cache applies here too
+        "messages": [
+            {"role": "system", "content": GENERATION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0
+    }
+    partial_path = f"{output_path}.partial" if output_path else None
+    html_code, _ = await complete_with_fallback(request_params, partial_path)
+    return html_code
+
+
+async def validate_generated_html(html_code, app_folder, attachment_names, output_path=None, repo_files=()):
+    """
+    Check a generated page before it is pushed. Mechanical problems are fixed
+    in place; anything else gets up to HTML_REPAIR_ATTEMPTS targeted LLM repairs.
+    Pages that still fail are pushed anyway, with the problems recorded on the job.
+    """
+    problems = find_page_problems(html_code, app_folder, attachment_names, repo_files)
+    found = len(problems)
+    repairs = 0
+    while problems:
+        if any(fix is not None for _, _, fix in problems):
+            html_code = apply_page_fixes(html_code, problems)
+            problems = find_page_problems(html_code, app_folder, attachment_names, repo_files)
+            if not problems:
+                break
+        if repairs >= HTML_REPAIR_ATTEMPTS:
+            break
+        repairs += 1
+        log(f"🩹 Repairing {len(problems)} page problem(s): " + "; ".join(detail for _, detail, _ in problems))
+        try:
+            html_code = await repair_generated_html(html_code, problems, attachment_names, output_path)
+        except Exception as e:
+            log(f"⚠️ Page repair failed: {e}")
+            break
+        problems = find_page_problems(html_code, app_folder, attachment_names, repo_files)
+
+    if not found:
+        outcome = "passed"
+    elif problems:
+        outcome = "failed"
+        log("⚠️ Pushing page with unresolved problems: " + "; ".join(detail for _, detail, _ in problems))
+    else:
+        outcome = "repaired" if repairs else "autofixed"
+        log(f"✅ Fixed {found} page problem(s) ({outcome})")
+    HTML_VALIDATIONS.labels(outcome).inc()
+    await record_job_stats(
+        validation=outcome,
+        validation_problems=found,
+        validation_repairs=repairs,
+        validation_unresolved=[detail for _, detail, _ in problems]
+    )
+    return write_generated_html(output_path, html_code)
 
-        return html_code
 
-    except Exception as e:
-        # 🆕 IMPROVED GENERIC FALLBACK
-        return f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>Web Application</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }}
-        .container {{ background: #f5f5f5; padding: 20px; border-radius: 8px; }}
-        .error {{ color: red; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Application Generator</h1>
-        <p><strong>Task:</strong> {brief}</p>
-        <div id="content">
-            <p class="error">Application generation failed. Please check the backend logs.</p>
-        </div>
-    </div>
-</body>
-</html>"""
-        
 # --- NEW FUNCTION FOR BACKGROUND WORK ---
-def process_submission_and_notify(data: dict, task_name: str, round_number: int):
-    """Handles ALL the slow work for ANY task type"""
-    import requests
-    import time
-    
-    print(f"Processing task: {task_name}, round: {round_number}")
+async def process_submission_and_notify(data: dict, task_name: str, round_number: int):
+    """Handles ALL the slow work for ANY task type without blocking the event loop"""
+    log(f"Processing task: {task_name}, round: {round_number}")
 
+    app_folder = workspaces.acquire(task_name)
+    try:
+        await build_and_push(data, task_name, round_number, app_folder)
+    finally:
+        workspaces.release(app_folder)
+        busy_tasks = await asyncio.to_thread(get_job_store().running_tasks)
+        await asyncio.to_thread(workspaces.evict, busy_tasks)
+
+
+async def build_and_push(data, task_name, round_number, app_folder):
+    """Attachments, generation and push for one job inside its workspace folder"""
     # --- SETUP AND ATTACHMENTS ---
-    os.makedirs(task_name, exist_ok=True)
     attachments = data.get("attachments", [])
-    saved_attachments = decode_attachments(attachments, task_name)
+    async with job_stage("attachments"):
+        saved_attachments = await decode_attachments(attachments, app_folder)
+    # Drop the (possibly huge) inline payloads now that they are on disk;
+    # the rest of the pipeline only needs the names
+    attachments = data["attachments"] = [
+        {"name": att.get("name") or att.get("filename")} for att in attachments
+    ]
     # Optionally, get a summary for LLM context
     attach_summary = summarize_attachment_meta(saved_attachments)
 
     
 
     # CODE GENERATION (uses generic function above)
-    index_file = f"{task_name}/index.html"
+    index_file = os.path.join(app_folder, "index.html")
     previous_code = None
-    if round_number == 2 and os.path.exists(index_file):
-        with open(index_file, "r", encoding="utf-8") as f:
-            previous_code = f.read()
-
-    try:
-        generated_html = generate_code_from_brief(
+    repo_files = set()
+
+    # A GenerationFailed here fails the job instead of pushing a placeholder page;
+    # resubmitting the request re-queues it
+    async with job_stage("generate"):
+        if round_number == 2:
+            previous_code, repo_files = await load_previous_code(task_name, index_file)
+        generated_html = await generate_code_from_brief(
             data.get("brief", ""),
             attachments,
             previous_code,
             data.get("checks", []),
             data.get("seed"),
-            
+            use_cache=not data.get("bypass_cache", False),
+            output_path=index_file
         )
-    except Exception as e:
-        generated_html = f"<p>Failed to generate code: {e}</p>"
 
-    # Save generated page
-    with open(index_file, "w", encoding="utf-8") as f:
-        f.write(generated_html)
-        
+    # Cheap local checks before a push / Pages build / evaluator round trip
+    if HTML_VALIDATION:
+        async with job_stage("validate"):
+            generated_html = await validate_generated_html(
+                generated_html, app_folder, [att["name"] for att in attachments], output_path=index_file,
+                repo_files=repo_files
+            )
+
     # GITHUB PUSH
     try:
-        repo_url, pages_url, commit_sha = create_or_update_repo(
-            task_name, task_name, round_number, data.get("brief", "")
-        )
+        async with job_stage("push"):
+            repo_full_name, repo_url, pages_url, commit_sha = await create_or_update_repo(
+                app_folder, task_name, round_number, data.get("brief", "")
+            )
     except Exception as e:
-        print(f"❌ GitHub push failed: {e}")
-        return 
+        log(f"❌ GitHub push failed: {e}")
+        raise
+
+    # Attachments now live in the repo; keep only what round 2 needs
+    await asyncio.to_thread(workspaces.prune, app_folder)
+
+    # PAGES READINESS + EVALUATION NOTIFICATION
+    # Tracked in its own task so this worker can move on to the next job
+    deployment = {
+        "repo": repo_full_name,
+        "repo_url": repo_url,
+        "pages_url": pages_url,
+        "commit_sha": commit_sha
+    }
+    await record_job_stats(deployment=deployment)
+    # Deploying before the tracker starts: a live build can make the tracker finish the job right away
+    job_id = current_job_id.get()
+    if job_id and not await asyncio.to_thread(get_job_store().finish, job_id, "deploying"):
+        return
+    start_deployment_tracking(job_id, data, round_number, deployment)
 
-    # EVALUATION NOTIFICATION
-    if data.get("evaluation_url"):
-        def send_evaluation_async_inner():
-            payload = {
-                "email": data.get("email"),
-                "task": data.get("task"),
-                "round": round_number,
-                "nonce": data.get("nonce"),
-                "repo_url": repo_url,
-                "commit_sha": commit_sha,
-                "pages_url": pages_url
-            }
-            print("🚀 Sending evaluation notification...")
-            delay = 1
-            for i in range(3):
-                try:
-                    r = requests.post(data["evaluation_url"], json=payload, timeout=5)
-                    if r.status_code == 200:
-                        print("✅ Evaluation POST successful")
-                        return
-                    else:
-                        print(f"⚠️ Evaluation POST failed: {r.status_code}")
-                except Exception as e:
-                    print(f"⚠️ Evaluation POST error: {e}")
-                if i < 2:
-                    time.sleep(delay)
-                    delay *= 2
-            print("❌ Evaluation notification failed after 3 attempts")
-            
-        send_evaluation_async_inner()
-        print("🚀 Completed background evaluation notification")
 
+# --- Evaluator notification outbox ---
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", "20"))
+OUTBOX_PER_HOST = int(os.environ.get("OUTBOX_PER_HOST", "4"))
+OUTBOX_BASE_DELAY = float(os.environ.get("OUTBOX_BASE_DELAY", "2"))
+OUTBOX_MAX_DELAY = float(os.environ.get("OUTBOX_MAX_DELAY", "600"))
+# Give up on a notification this many seconds after it was written
+OUTBOX_HORIZON = float(os.environ.get("OUTBOX_HORIZON", str(24 * 3600)))
+OUTBOX_TIMEOUT = float(os.environ.get("OUTBOX_TIMEOUT", "10"))
 
 
+class NotificationOutbox:
+    """
+    Evaluator notifications persisted in SQLite and delivered by
+    dispatch_notifications, independently of the job workers.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id TEXT PRIMARY KEY,
+                    job_id TEXT,
+                    url TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def enqueue(self, job_id, url, payload):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO outbox (id, job_id, url, payload, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                (uuid.uuid4().hex, job_id, url, json.dumps(payload), now, now, now)
+            )
 
-@app.post("/api-endpoint")
-async def api_endpoint(request: Request, background_tasks: BackgroundTasks):
+    def claim_due(self, limit):
+        """
+        Take up to `limit` due messages for delivery by this process. They are
+        pushed JOB_LEASE_TTL into the future, so no other dispatcher sends them
+        meanwhile, and become due again if this process dies mid-delivery.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit)
+                ).fetchall()
+                for row in rows:
+                    self.conn.execute(
+                        "UPDATE outbox SET next_attempt_at = ? WHERE id = ?", (now + JOB_LEASE_TTL, row["id"])
+                    )
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return [dict(row) for row in rows]
+
+    def next_due_in(self):
+        """Seconds until the next pending notification is due (None if none)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0)
+
+    def mark_delivered(self, message_id):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'delivered', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (time.time(), message_id)
+            )
+
+    def mark_failed(self, message, error, permanent=False):
+        """Schedule a retry with jittered exponential backoff, or give up"""
+        now = time.time()
+        attempts = message["attempts"] + 1
+        delay = min(OUTBOX_BASE_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_DELAY)
+        # Equal jitter: spread retries so a recovering evaluator is not hit all at once
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        expired = now + delay - message["created_at"] > OUTBOX_HORIZON
+        status = "dead" if permanent or expired else "pending"
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (status, attempts, now + delay, error, now, message["id"])
+            )
+        return status, delay
+
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+
+def get_outbox():
+    """Shared evaluator notification outbox, opened on first use"""
+    global _outbox
+    if _outbox is None:
+        with _store_lock:
+            if _outbox is None:
+                _outbox = NotificationOutbox(JOBS_DB_PATH)
+    return _outbox
+
+
+outbox_wakeup = asyncio.Event()
+
+
+def build_evaluation_payload(data, round_number, deployment):
+    return {
+        "email": data.get("email"),
+        "task": data.get("task"),
+        "round": round_number,
+        "nonce": data.get("nonce"),
+        "repo_url": deployment["repo_url"],
+        "commit_sha": deployment["commit_sha"],
+        "pages_url": deployment["pages_url"]
+    }
+
+
+async def deliver_notification(message, host_semaphore):
+    """One delivery attempt of an outbox message"""
+    payload = json.loads(message["payload"])
+    # Runs in its own task, so these only label this delivery's logs and metrics
+    current_job_id.set(message["job_id"])
+    current_stage.set("notify")
+    try:
+        async with host_semaphore:
+            r = await get_http_client().post(message["url"], json=payload, timeout=OUTBOX_TIMEOUT)
+        if 200 <= r.status_code < 300:
+            await asyncio.to_thread(get_outbox().mark_delivered, message["id"])
+            if message["job_id"]:
+                await asyncio.to_thread(get_job_store().mark_stage, message["job_id"], "notify", "finished")
+            STAGE_SECONDS.labels("notify", "ok").observe(time.time() - message["created_at"])
+            log(f"✅ Evaluation POST successful ({payload.get('task')} round {payload.get('round')})")
+            return
+        # Other client errors will not succeed on retry
+        permanent = 400 <= r.status_code < 500 and r.status_code not in (408, 425, 429)
+        error = f"HTTP {r.status_code}"
+    except Exception as e:
+        permanent = False
+        error = str(e) or type(e).__name__
+    status, delay = await asyncio.to_thread(get_outbox().mark_failed, message, error, permanent)
+    if status == "dead":
+        STAGE_SECONDS.labels("notify", "error").observe(time.time() - message["created_at"])
+        log(f"❌ Evaluation notification to {message['url']} abandoned after {message['attempts'] + 1} attempts: {error}")
+    else:
+        log(f"⚠️ Evaluation POST failed ({error}), retrying in {delay:.0f}s")
+
+
+async def dispatch_notifications():
+    """Deliver due outbox messages until cancelled, capped overall and per evaluator host"""
+    in_flight = set()
+    host_semaphores = {}
+    while True:
+        for message in await asyncio.to_thread(get_outbox().claim_due, OUTBOX_CONCURRENCY - len(in_flight)):
+            host = httpx.URL(message["url"]).host
+            if host not in host_semaphores:
+                host_semaphores[host] = asyncio.Semaphore(OUTBOX_PER_HOST)
+            task = asyncio.create_task(deliver_notification(message, host_semaphores[host]))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            task.add_done_callback(lambda _: outbox_wakeup.set())
+
+        # Sleep until the next retry is due, something is enqueued or a delivery finishes
+        timeout = await asyncio.to_thread(get_outbox().next_due_in)
+        timeout = 5.0 if timeout is None else min(max(timeout, 0.05), 5.0)
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        outbox_wakeup.clear()
+
+
+# Detached deployment trackers; referenced here so they are not garbage collected
+deployment_tasks = set()
+# Job id -> tracker task, for the jobs whose lease this process renews
+tracked_jobs = {}
+# Jobs this process's workers are running
+running_jobs = set()
+
+
+def start_deployment_tracking(job_id, data, round_number, deployment):
+    task = asyncio.create_task(track_deployment(job_id, data, round_number, deployment))
+    deployment_tasks.add(task)
+    task.add_done_callback(deployment_tasks.discard)
+    if job_id:
+        tracked_jobs[job_id] = task
+        task.add_done_callback(lambda _: tracked_jobs.pop(job_id, None))
+    DEPLOYMENTS_TRACKED.inc()
+    task.add_done_callback(lambda _: DEPLOYMENTS_TRACKED.dec())
+
+
+async def resume_orphaned_deployments():
+    """Track deploying jobs no live process is tracking (their tracker's process stopped)"""
+    for job in await asyncio.to_thread(get_job_store().claim_orphaned_deployments):
+        log(f"🔁 Resuming deployment tracking of job {job['id']}")
+        start_deployment_tracking(job["id"], job["payload"], job["round"], job["stats"]["deployment"])
+
+
+async def renew_job_leases():
     """
-    Receives the request, validates, starts the slow task in the background, 
-    and returns 200 immediately.
+    Heartbeat: keep the leases of this process's jobs alive, stop trackers
+    whose job was taken over, and adopt jobs of stopped processes.
+    Finished jobs past JOB_RETENTION are deleted once every JOB_PURGE_INTERVAL.
     """
-    # 1. Handle validation (MUST be sync and fast)
+    next_purge = time.monotonic()
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        owned = running_jobs | set(tracked_jobs)
+        if owned:
+            for job_id in owned - await asyncio.to_thread(get_job_store().renew_leases, owned):
+                log(f"⚠️ Lost the lease on job {job_id} to another worker")
+                if job_id in tracked_jobs:
+                    tracked_jobs[job_id].cancel()
+        await asyncio.to_thread(get_job_store().release_dead_owners)
+        await resume_orphaned_deployments()
+        if time.monotonic() >= next_purge:
+            next_purge = time.monotonic() + JOB_PURGE_INTERVAL
+            purged = await asyncio.to_thread(get_job_store().purge_finished, time.time() - JOB_RETENTION)
+            if purged:
+                log(f"🧹 Deleted {purged} jobs finished more than {JOB_RETENTION:.0f}s ago")
+
+
+async def finish_job(job_id, status, error=None):
+    """Record a job's final state and its end-to-end duration"""
+    if not await asyncio.to_thread(get_job_store().finish, job_id, status, error):
+        return
+    if status == "failed":
+        error = f"superseding job {job_id} failed: {error}"
+    settled = await asyncio.to_thread(get_job_store().settle_superseded, job_id, status, error)
+    if settled:
+        log(f"⏭️ Marked {settled} superseded submission(s) {status}")
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job:
+        JOB_SECONDS.labels(str(job["round"]), status).observe(job["updated_at"] - job["created_at"])
+
+
+async def track_deployment(job_id, data, round_number, deployment):
+    """Wait for the Pages build of the pushed commit, then notify the evaluator"""
+    token = current_job_id.set(job_id)
+    # Trackers resumed at startup start a fresh count
+    calls = current_job_calls.get()
+    calls_token = current_job_calls.set(calls if calls is not None else Counter())
     try:
-        data = await request.json()
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid JSON data")
-    
-    # NOTE: EXPECTED_SECRET must be defined globally at the top of file
-    if data.get("secret") != EXPECTED_SECRET: 
-        raise HTTPException(status_code=400, detail="invalid secret")
+        async with job_stage("pages"):
+            await wait_for_pages_build(deployment["repo"], deployment["commit_sha"])
+        if data.get("evaluation_url"):
+            # Written once; the dispatcher owns delivery and retries from here
+            if job_id:
+                await asyncio.to_thread(get_job_store().mark_stage, job_id, "notify", "started")
+            await asyncio.to_thread(
+                get_outbox().enqueue, job_id, data["evaluation_url"], build_evaluation_payload(data, round_number, deployment)
+            )
+            outbox_wakeup.set()
+            log("🚀 Evaluation notification queued")
+        if job_id:
+            # Submissions this job superseded get the same deployment under their own nonce
+            for superseded in await asyncio.to_thread(get_job_store().superseded_jobs, job_id):
+                superseded_data = superseded["payload"]
+                if superseded_data.get("evaluation_url"):
+                    await asyncio.to_thread(get_job_store().mark_stage, superseded["id"], "notify", "started")
+                    await asyncio.to_thread(get_outbox().enqueue, superseded["id"], superseded_data["evaluation_url"],
+                                            build_evaluation_payload(superseded_data, round_number, deployment))
+                    outbox_wakeup.set()
+                    log(f"🚀 Evaluation notification queued for superseded job {superseded['id']}")
+        if job_id:
+            await record_job_stats(outbound_calls=dict(current_job_calls.get()))
+            await finish_job(job_id, "done")
+    except asyncio.CancelledError:
+        # Left as "deploying"; resumed on next startup
+        raise
+    except Exception as e:
+        log(f"❌ Deployment tracking failed: {e}")
+        if job_id:
+            await finish_job(job_id, "failed", str(e))
+    finally:
+        current_job_calls.reset(calls_token)
+        current_job_id.reset(token)
+
+
+async def run_job(job):
+    """Execute one claimed job and record its final state"""
+    token = current_job_id.set(job["id"])
+    calls_token = current_job_calls.set(Counter())
+    batch_token = current_batch_id.set(job["batch_id"])
+    running_jobs.add(job["id"])
+    try:
+        await process_submission_and_notify(job["payload"], job["task"], job["round"])
+        # Pages readiness and the evaluator notification continue in a tracker task
+        # (build_and_push already marked the job deploying)
+        log(f"✅ Job {job['id']} pushed, tracking deployment")
+    except Exception as e:
+        await finish_job(job["id"], "failed", str(e))
+        # Let an evaluator retry of this submission run it again
+        nonce_cache.discard(idempotency_key(job["task"], job["round"], job["nonce"]))
+        log(f"❌ Job {job['id']} failed: {e}")
+        traceback.print_exc()
+    finally:
+        running_jobs.discard(job["id"])
+        await record_job_stats(outbound_calls=dict(current_job_calls.get()))
+        current_batch_id.reset(batch_token)
+        current_job_calls.reset(calls_token)
+        current_job_id.reset(token)
+        # Queued jobs of the same task can run now
+        job_wakeup.set()
+
+
+async def job_worker(worker_number):
+    """Drain the job queue until cancelled"""
+    while True:
+        # Backpressure: past MAX_IN_FLIGHT_JOBS, let running jobs and deployments drain first
+        in_flight = len(running_jobs) + len(tracked_jobs)
+        job = await asyncio.to_thread(get_job_store().claim_next) if in_flight < MAX_IN_FLIGHT_JOBS else None
+        if job is None:
+            # Sleep until a new job is enqueued (or poll again after 1s)
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            job_wakeup.clear()
+            continue
+        log(f"👷 Worker {worker_number} picked job {job['id']} ({job['task']}, round {job['round']})")
+        await run_job(job)
+
 
+# Bytes of request bodies this process is reading / parsing right now
+buffered_body_bytes = 0
+
+
+def retry_after():
+    # Jittered so that turned-away clients do not all come back at once
+    return str(int(ADMISSION_RETRY_AFTER * random.uniform(1.0, 1.5)))
+
+
+def overloaded(status_code, reason, detail):
+    """HTTPException (429 / 503 with Retry-After) for a submission turned away by admission control"""
+    ADMISSION_REJECTIONS.labels(reason).inc()
+    log(f"🚦 Turned away a submission ({reason}): {detail}")
+    return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": retry_after()})
+
+
+@asynccontextmanager
+async def admitted_body(request):
+    """
+    Read and parse a JSON request body, holding its size against
+    ADMISSION_MAX_BUFFERED_BYTES until the block exits. Yields (data, size).
+    The declared Content-Length is reserved up front; the body is then read
+    chunk by chunk and counted as it arrives, so chunked bodies (and bodies
+    longer than declared) hit the same limits.
+    """
+    global buffered_body_bytes
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared = 0
+
+    def reserve(size, reserved):
+        """Grow this request's share of buffered_body_bytes to size; returns the new share"""
+        global buffered_body_bytes
+        if size > ADMISSION_MAX_BUFFERED_BYTES:
+            raise HTTPException(status_code=413,
+                                detail=f"Request body larger than {ADMISSION_MAX_BUFFERED_BYTES} bytes")
+        if size > reserved and buffered_body_bytes + size - reserved > ADMISSION_MAX_BUFFERED_BYTES:
+            raise overloaded(503, "buffered_bytes", "Too many submissions being received, retry later")
+        buffered_body_bytes += max(size - reserved, 0)
+        return max(size, reserved)
+
+    reserved = reserve(declared, 0)
+    try:
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            chunks.append(chunk)
+            size += len(chunk)
+            reserved = reserve(size, reserved)
+        try:
+            data = json.loads(b"".join(chunks))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON data")
+        yield data, size
+    finally:
+        buffered_body_bytes -= reserved
+
+
+async def check_queue_bytes(size):
+    """503 when the queued payloads plus size would exceed ADMISSION_MAX_QUEUED_BYTES; returns the queued job count"""
+    queued, queued_bytes = await asyncio.to_thread(get_job_store().queue_load)
+    if queued_bytes + size > ADMISSION_MAX_QUEUED_BYTES:
+        raise overloaded(503, "queued_bytes", "The job queue holds too much attachment data, retry later")
+    return queued
+
+
+def admission_stats():
+    queued, queued_bytes = get_job_store().queue_load()
+    return {
+        "queued_jobs": queued,
+        "queued_bytes": queued_bytes,
+        "buffered_body_bytes": buffered_body_bytes,
+        "in_flight_jobs": len(running_jobs) + len(tracked_jobs)
+    }
+
+
+REQUIRED_FIELDS = ['email', 'task', 'round', 'nonce', 'brief', 'evaluation_url']
+
+
+def submission_error(data):
+    """Why a submission cannot be accepted, or None"""
+    if not isinstance(data, dict):
+        return "Submission must be a JSON object"
+    # NOTE: EXPECTED_SECRET must be defined globally at the top of file
+    if data.get("secret") != EXPECTED_SECRET:
+        return "invalid secret"
     # Quick validation of essential fields
-    required_fields = ['email', 'task', 'round', 'nonce', 'brief', 'evaluation_url']
-    for field in required_fields:
+    for field in REQUIRED_FIELDS:
         if field not in data:
-            raise HTTPException(status_code=400, detail=f"Missing required field: {field}")
-            
-    task_name = data.get("task")
-    round_number = data.get("round")
-    
-    # 🆕 ADD THIS: Create GitHub Pages URL immediately
+            return f"Missing required field: {field}"
+    return None
+
+
+async def cached_submission_response(key):
+    """The response to a recent identical submission, unless its job has failed or been superseded since"""
+    cached_response = nonce_cache.get(key)
+    if cached_response is None:
+        return None
+    # The job may have failed or been superseded in another worker process since;
+    # then the submission is looked up again (and re-queued if it failed)
+    cached_job = await asyncio.to_thread(get_job_store().get, cached_response["job_id"])
+    if cached_job is not None and cached_job["status"] in ("failed", "superseded"):
+        return None
+    return cached_response
+
+
+def submission_response(job):
+    """The accepted response for a queued job, with its GitHub Pages URL"""
+    task_name = job["task"]
+    round_number = job["round"]
     github_username = "23f1003086"  # Your GitHub username
     pages_url = f"https://{github_username}.github.io/{task_name}/"
     repo_url = f"https://github.com/{github_username}/{task_name}"
-    
-    # 2. Start the slow process in the background
-    background_tasks.add_task(
-        process_submission_and_notify, 
-        data, 
-        task_name, 
-        round_number
-    )
-    
-    print("🚀 Background task started. Returning HTTP 200 immediately.")
-    
-    # 3. Return the immediate 200/accepted response WITH URL
     return {
         "status": "accepted",
         "task": task_name,
         "round": round_number,
-        "pages_url": pages_url,  # 🆕 ADD THIS
-        "repo_url": repo_url,    # 🆕 ADD THIS
+        "job_id": job["id"],
+        "status_url": f"/jobs/{task_name}/{round_number}",
+        "pages_url": pages_url,
+        "repo_url": repo_url,
         "message": f"Processing started in background. Your app will be available at: {pages_url}"
     }
+
+
+@app.post("/api-endpoint")
+async def api_endpoint(request: Request):
+    """
+    Receives the request, validates, persists the job to the queue 
+    and returns 200 immediately.
+    """
+    async with admitted_body(request) as (data, size):
+        return await accept_submission(data, size)
+
+
+async def accept_submission(data, size):
+    """Validate, de-duplicate and queue one submission; size is its body size in bytes"""
+    # 1. Handle validation (MUST be sync and fast)
+    error = submission_error(data)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    task_name = data.get("task")
+    round_number = data.get("round")
+
+    # Repeats of a recent (task, round, nonce) get the original response
+    key = idempotency_key(task_name, round_number, data.get("nonce"))
+    cached_response = await cached_submission_response(key)
+    if cached_response is not None:
+        log(f"♻️ Duplicate submission for {task_name} round {round_number}, returning existing job")
+        return cached_response
+
+    # Shed load before queueing more; updates of tasks that already ran still get in
+    queued = await check_queue_bytes(size)
+    if queued >= ADMISSION_MAX_QUEUED_JOBS and not await asyncio.to_thread(get_job_store().is_update, task_name, round_number):
+        raise overloaded(429, "queued_jobs", f"{queued} jobs are queued, retry later")
+
+    # 2. Persist the job; a worker picks it up.
+    # Concurrent identical submissions collapse onto the same row.
+    job, created = await asyncio.to_thread(get_job_store().enqueue, data)
+    if created:
+        job_wakeup.set()
+        log(f"🚀 Job {job['id']} queued. Returning HTTP 200 immediately.")
+    elif job["status"] == "failed":
+        await asyncio.to_thread(get_job_store().requeue, job["id"])
+        job_wakeup.set()
+        log(f"🔁 Job {job['id']} failed before, re-queued on retry.")
+    else:
+        log(f"♻️ Job {job['id']} already {job['status']}, not starting a new run.")
+
+    # 3. Return the immediate 200/accepted response WITH URL
+    response = submission_response(job)
+    nonce_cache.put(key, response)
+    return response
+
+
+@app.post("/api-endpoint/batch")
+async def api_endpoint_batch(request: Request):
+    """
+    Accepts many submissions in one request: {"secret": ..., "submissions": [...]}
+    (items may leave out the secret). Each item is validated and de-duplicated
+    like a POST /api-endpoint, all new jobs are queued in one transaction as a
+    batch, and the response has a result per item in submission order.
+    When the queue is full only updates of tasks that already ran are queued;
+    the other items are rejected with a retry_after.
+    """
+    async with admitted_body(request) as (body, size):
+        return await accept_batch(body, size)
+
+
+async def accept_batch(body, size):
+    """Validate, de-duplicate and queue the items of a batch submission"""
+    if not isinstance(body, dict) or not isinstance(body.get("submissions"), list):
+        raise HTTPException(status_code=400, detail='Expected {"secret": ..., "submissions": [...]}')
+    if body.get("secret") != EXPECTED_SECRET:
+        raise HTTPException(status_code=400, detail="invalid secret")
+    submissions = body["submissions"]
+    if len(submissions) > BATCH_MAX_SUBMISSIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_SUBMISSIONS} submissions per batch")
+
+    results = [None] * len(submissions)
+    pending = []
+    for index, data in enumerate(submissions):
+        if isinstance(data, dict):
+            data = {"secret": body["secret"], **data}
+        error = submission_error(data)
+        if error:
+            results[index] = {"index": index, "status": "rejected", "error": error}
+            continue
+        key = idempotency_key(data["task"], data["round"], data.get("nonce"))
+        cached_response = await cached_submission_response(key)
+        if cached_response is not None:
+            results[index] = {"index": index, **cached_response}
+            continue
+        pending.append((index, data, key))
+
+    if pending:
+        free = ADMISSION_MAX_QUEUED_JOBS - await check_queue_bytes(size)
+        admitted = []
+        for index, data, key in pending:
+            if free > 0 or await asyncio.to_thread(get_job_store().is_update, data["task"], data["round"]):
+                admitted.append((index, data, key))
+                free -= 1
+                continue
+            ADMISSION_REJECTIONS.labels("queued_jobs").inc()
+            results[index] = {
+                "index": index, "status": "rejected", "error": "Too many queued jobs", "retry_after": int(retry_after())
+            }
+        if not admitted:
+            raise overloaded(429, "queued_jobs", "Too many queued jobs, retry later")
+        pending = admitted
+
+    batch_id = uuid.uuid4().hex
+    queued = 0
+    if pending:
+        jobs = await asyncio.to_thread(get_job_store().enqueue_many, [data for _, data, _ in pending], batch_id)
+        for (index, _, key), (job, created) in zip(pending, jobs):
+            if created:
+                queued += 1
+            elif job["status"] == "failed":
+                await asyncio.to_thread(get_job_store().requeue, job["id"])
+                queued += 1
+            response = submission_response(job)
+            nonce_cache.put(key, response)
+            results[index] = {"index": index, **response}
+        job_wakeup.set()
+
+    rejected = sum(1 for result in results if result["status"] == "rejected")
+    log(f"📦 Batch {batch_id}: {len(submissions)} submissions, {queued} queued, {rejected} rejected")
+    return {
+        "batch_id": batch_id,
+        "submissions": len(submissions),
+        "queued": queued,
+        "rejected": rejected,
+        "results": results
+    }
+
+
+@app.get("/jobs/{task}/{round_number}")
+def job_status(task: str, round_number: int):
+    """State and per-stage timestamps of the latest job for a task round"""
+    job = get_job_store().get_latest(task, round_number)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "task": job["task"],
+        "round": job["round"],
+        "nonce": job["nonce"],
+        "batch_id": job["batch_id"],
+        "status": job["status"],
+        "stages": job["stages"],
+        "stats": job["stats"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
         
 
 
+@app.get("/stats")
+def stats():
+    """Process-level counters"""
+    return {
+        "llm_cache": llm_cache.stats(),
+        "github": github_scheduler.stats(),
+        "workspaces": workspaces.usage(),
+        "git_mirrors": git_mirrors.usage() if git_mirrors is not None else None,
+        "outbox": get_outbox().counts(),
+        "admission": admission_stats()
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage/job histograms, outbound HTTP counters and queue gauges"""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Several uvicorn workers: merge what every process has written
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(
+        generate_latest(registry) + generate_latest(queue_registry), media_type=CONTENT_TYPE_LATEST
+    )
+
+
 if __name__ == "__main__":
     # Use Uvicorn to run the FastAPI app
+    import sys
+    import tempfile
+    # Worker processes share the job queue through JOBS_DB_PATH (see JobStore leases)
+    if WEB_CONCURRENCY > 1:
+        # Must be set before the workers import prometheus_client
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+        # Hand over to the uvicorn CLI: workers spawned from this script would import it twice
+        os.execv(sys.executable, [
+            sys.executable, "-m", "uvicorn", "app:app", "--host", "0.0.0.0", "--port", "7860",
+            "--workers", str(WEB_CONCURRENCY), "--app-dir", os.path.dirname(os.path.abspath(__file__))
+        ])
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=7860)
@@ -0,0 +1,389 @@
+"""
+End-to-end benchmark of the submission pipeline.
+
+Starts app.py under uvicorn in a scratch directory, pointed at local fakes
+for GitHub, OpenAI, GitHub Pages and the evaluator (see fakes.py), submits
+N round-1 tasks concurrently, then their round-2 updates, and reports per
+stage p50/p95/p99, throughput and the app's peak RSS (summed over uvicorn
+worker processes).
+
+    python benchmarks/bench_pipeline.py --tasks 20
+    python benchmarks/bench_pipeline.py --tasks 20 --compare benchmarks/results/<earlier>.json
+
+Results are written to benchmarks/results/ as JSON.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import uvicorn
+
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+STAGES = ["queued", "attachments", "generate", "validate", "push", "pages", "notify"]
+SECRET = "bench-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def serve(app):
+    """Run a fake on a free local port; returns (server, task, base_url)"""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a list (q in 0..100)"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "max": max(values)
+    }
+
+
+def process_tree(pid):
+    """pid and its descendants, e.g. uvicorn worker processes (Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    pids = [pid]
+    for current in pids:
+        pids.extend(children.get(current, []))
+    return pids
+
+
+def peak_rss_bytes(pid):
+    """High-water RSS of a running process and its children, summed (Linux); None elsewhere"""
+    if not os.path.isdir(f"/proc/{pid}"):
+        return None
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_app(workdir, env_overrides, log_path):
+    port = free_port()
+    env = dict(os.environ)
+    env.update(env_overrides)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONUNBUFFERED"] = "1"
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return process, f"http://127.0.0.1:{port}", log
+
+
+async def wait_until_ready(client, url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode} during startup")
+        try:
+            if (await client.get(url + "/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("app did not become ready")
+
+
+def submission(task, round_number, evaluator_url, attachment_bytes):
+    data = {
+        "email": "bench@example.com",
+        "secret": SECRET,
+        "task": task,
+        "round": round_number,
+        "nonce": f"{task}-r{round_number}",
+        "brief": f"Benchmark app {task}, round {round_number}: show a sortable table of the attached data.",
+        "checks": ["Repo has MIT license", "Page has a table"],
+        "evaluation_url": evaluator_url + "/notify",
+        "attachments": []
+    }
+    if round_number == 1 and attachment_bytes:
+        content = base64.b64encode(os.urandom(attachment_bytes)).decode()
+        data["attachments"].append({"name": "data.bin", "url": f"data:application/octet-stream;base64,{content}"})
+    return data
+
+
+async def run_round(client, app_url, tasks, round_number, args, evaluator, github):
+    """Submit one round for every task concurrently and wait for all jobs to finish"""
+    limit = asyncio.Semaphore(args.concurrency)
+    submit_latencies = []
+
+    async def submit(task):
+        async with limit:
+            started = time.perf_counter()
+            r = await client.post(app_url + "/api-endpoint", json=submission(
+                task, round_number, args.evaluator_url, args.attachment_bytes))
+            submit_latencies.append(time.perf_counter() - started)
+            r.raise_for_status()
+
+    async def submit_batch(batch):
+        async with limit:
+            started = time.perf_counter()
+            r = await client.post(app_url + "/api-endpoint/batch", json={"secret": SECRET, "submissions": [
+                submission(task, round_number, args.evaluator_url, args.attachment_bytes) for task in batch]})
+            submit_latencies.append(time.perf_counter() - started)
+            r.raise_for_status()
+
+    started = time.time()
+    if args.batch_size:
+        batches = [tasks[i:i + args.batch_size] for i in range(0, len(tasks), args.batch_size)]
+        await asyncio.gather(*(submit_batch(batch) for batch in batches))
+    else:
+        await asyncio.gather(*(submit(task) for task in tasks))
+
+    # A job is complete once the evaluator has it, or once it failed
+    jobs = {}
+    pending = set(tasks)
+    deadline = time.monotonic() + args.timeout
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        for task in list(pending):
+            r = await client.get(f"{app_url}/jobs/{task}/{round_number}")
+            if r.status_code != 200:
+                continue
+            job = r.json()
+            notified = (task, round_number) in evaluator.received
+            if job["status"] in ("failed", "superseded") or (
+                    job["status"] == "done" and notified and job["stages"].get("notify", {}).get("finished")):
+                jobs[task] = job
+                pending.discard(task)
+    elapsed = time.time() - started
+
+    stage_durations = {stage: [] for stage in STAGES}
+    end_to_end = []
+    for task, job in jobs.items():
+        for stage in STAGES:
+            times = job["stages"].get(stage, {})
+            if "started" in times and "finished" in times:
+                stage_durations[stage].append(times["finished"] - times["started"])
+        if job["status"] == "done":
+            end_to_end.append(evaluator.received[(task, round_number)] - job["created_at"])
+
+    # The Pages host must serve what was pushed for this round
+    served = 0
+    for task in jobs:
+        r = await client.get(f"{args.pages_url}/{task}/")
+        pushed = github.head_files(task).get("index.html") if task in github.repos else None
+        served += r.status_code == 200 and r.content == pushed
+
+    statuses = Counter(job["status"] for job in jobs.values())
+    statuses["timeout"] = len(pending)
+    completed = statuses.get("done", 0)
+    return {
+        "jobs": len(tasks),
+        "statuses": dict(statuses),
+        "pages_served": served,
+        "wall_seconds": elapsed,
+        "throughput_jobs_per_sec": completed / elapsed if elapsed else None,
+        "submit_latency": summarize(submit_latencies),
+        "end_to_end": summarize(end_to_end),
+        "stages": {stage: summarize(values) for stage, values in stage_durations.items()}
+    }
+
+
+def print_round(name, result):
+    print(f"\n== {name}: {result['jobs']} jobs, {result['statuses']}, "
+          f"{result['wall_seconds']:.1f}s, {result['throughput_jobs_per_sec'] or 0:.2f} jobs/s")
+    print(f"{'stage':<14}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    rows = list(result["stages"].items()) + [("end_to_end", result["end_to_end"]), ("submit", result["submit_latency"])]
+    for stage, s in rows:
+        if s["count"]:
+            print(f"{stage:<14}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+
+
+def print_comparison(result, baseline):
+    print(f"\n== Compared with {baseline.get('revision')} ({baseline.get('timestamp')})")
+    for name in ("round1", "round2"):
+        if name not in baseline or name not in result:
+            continue
+        old, new = baseline[name], result[name]
+        rows = [(stage, old["stages"].get(stage, {}), s) for stage, s in new["stages"].items()]
+        rows.append(("end_to_end", old["end_to_end"], new["end_to_end"]))
+        for stage, before, after in rows:
+            if before.get("count") and after.get("count"):
+                change = (after["p95"] - before["p95"]) / before["p95"] * 100 if before["p95"] else 0
+                print(f"{name} {stage:<14} p95 {before['p95']:.3f}s -> {after['p95']:.3f}s ({change:+.1f}%)")
+        old_tput, new_tput = old.get("throughput_jobs_per_sec"), new.get("throughput_jobs_per_sec")
+        if old_tput and new_tput:
+            print(f"{name} throughput {old_tput:.2f} -> {new_tput:.2f} jobs/s")
+    if baseline.get("peak_rss_bytes") and result.get("peak_rss_bytes"):
+        print(f"peak RSS {baseline['peak_rss_bytes'] / 2**20:.1f} -> {result['peak_rss_bytes'] / 2**20:.1f} MiB")
+
+
+async def main(args):
+    calls = Counter()
+    github = fakes.FakeGitHub(pages_build_delay=args.pages_build_delay)
+    evaluator = fakes.FakeEvaluator(failure_rate=args.evaluator_failure_rate)
+    servers = []
+    for name, app in [
+        ("github", github.app(args.github_latency, calls)),
+        ("openai", fakes.openai_app(args.openai_latency, calls, ttft=args.llm_ttft,
+                                    tokens_per_second=args.llm_tokens_per_sec, output_bytes=args.llm_output_bytes)),
+        ("pages", github.pages_app(args.pages_latency, calls)),
+        ("evaluator", evaluator.app(args.evaluator_latency, calls)),
+    ]:
+        server, task, url = await serve(app)
+        servers.append((server, task))
+        setattr(args, f"{name}_url", url)
+
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    shutil.copy(os.path.join(REPO_ROOT, "LICENSE"), workdir)
+    env = {
+        "PROJECT_SECRET": SECRET,
+        "GITHUB_TOKEN": "bench-token",
+        "GITHUB_API_URL": args.github_url,
+        # The fake GitHub has no git transport to mirror from
+        "GIT_MIRROR_DIR": "",
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": args.openai_url,
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "LLM_CACHE_DIR": os.path.join(workdir, "llm_cache"),
+        "WORKSPACE_ROOT": os.path.join(workdir, "workspaces"),
+    }
+    env.update(dict(item.split("=", 1) for item in args.env))
+    log_path = os.path.join(workdir, "app.log")
+    process, app_url, log = start_app(workdir, env, log_path)
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if not key.endswith("_url") and key != "compare"},
+    }
+    try:
+        async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=200)) as client:
+            await wait_until_ready(client, app_url, process)
+            tasks = [f"bench-{i:04d}" for i in range(args.tasks)]
+            result["round1"] = await run_round(client, app_url, tasks, 1, args, evaluator, github)
+            print_round("Round 1", result["round1"])
+            if not args.skip_round2:
+                result["round2"] = await run_round(client, app_url, tasks, 2, args, evaluator, github)
+                print_round("Round 2", result["round2"])
+            result["app_stats"] = (await client.get(app_url + "/stats")).json()
+    finally:
+        result["peak_rss_bytes"] = peak_rss_bytes(process.pid)
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if result["peak_rss_bytes"] is None:
+            # ru_maxrss is kB on Linux, bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            result["peak_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+        log.close()
+        for server, task in servers:
+            server.should_exit = True
+        await asyncio.gather(*(task for _, task in servers))
+
+    result["outbound_calls"] = dict(calls)
+    print(f"\npeak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB, outbound calls {dict(calls)}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}-{result['revision']}.json")
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {out_path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+    if args.keep:
+        print(f"App log and state kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=10, help="tasks submitted per round")
+    parser.add_argument("--concurrency", type=int, default=50, help="max submissions in flight")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="submit through POST /api-endpoint/batch, this many tasks per request (0: one request each)")
+    parser.add_argument("--skip-round2", action="store_true")
+    parser.add_argument("--attachment-bytes", type=int, default=32 * 1024, help="size of the round-1 attachment")
+    parser.add_argument("--github-latency", type=float, default=0.05, help="seconds added to each GitHub call")
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="seconds added to each OpenAI call")
+    parser.add_argument("--llm-ttft", type=float, default=0.5, help="seconds to the first streamed token")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=1000.0)
+    parser.add_argument("--llm-output-bytes", type=int, default=8000, help="size of each generated page")
+    parser.add_argument("--pages-latency", type=float, default=0.02)
+    parser.add_argument("--pages-build-delay", type=float, default=2.0, help="seconds from push to built Pages")
+    parser.add_argument("--evaluator-latency", type=float, default=0.05)
+    parser.add_argument("--evaluator-failure-rate", type=float, default=0.0, help="share of notifications answered 503")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a round to finish")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/pipeline-<time>-<rev>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the app's scratch directory and log")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,149 @@
+"""
+Cold-start benchmark.
+
+Measures, in fresh interpreters:
+- how long `import app` takes and which heavy libraries it loads
+- how long uvicorn takes from spawn until GET / answers and until
+  /api-endpoint rejects a bad secret (validation ready)
+
+Exits non-zero when a library that should load lazily is imported at
+startup, or when the median import time exceeds --max-import-seconds.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_pipeline import REPO_ROOT, RESULTS_DIR, free_port, git_revision
+
+# Only needed once a job runs (or never); must not load at import
+LAZY_MODULES = ["openai", "uvicorn", "tiktoken", "github", "requests", "PIL", "pytesseract", "flask"]
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def scratch_env(workdir):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    env["PROJECT_SECRET"] = "bench-secret"
+    env["JOBS_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    env["LLM_CACHE_DIR"] = os.path.join(workdir, "llm_cache")
+    env["WORKSPACE_ROOT"] = os.path.join(workdir, "workspaces")
+    return env
+
+
+def measure_import(workdir):
+    # A fresh directory (and database) each run, as on a freshly scaled-up instance
+    workdir = tempfile.mkdtemp(dir=workdir)
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=workdir, env=scratch_env(workdir),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure_server(workdir):
+    """Seconds from spawning uvicorn to GET / == 200 and to a validated 400 on /api-endpoint"""
+    workdir = tempfile.mkdtemp(dir=workdir)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=scratch_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {}
+    try:
+        with httpx.Client(timeout=5) as client:
+            deadline = started + 60
+            while "home" not in result and time.perf_counter() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError(f"app exited with code {process.returncode} during startup")
+                try:
+                    if client.get(url + "/").status_code == 200:
+                        result["home"] = time.perf_counter() - started
+                except httpx.HTTPError:
+                    time.sleep(0.005)
+            r = client.post(url + "/api-endpoint", json={"secret": "wrong"})
+            if r.status_code == 400:
+                result["validation"] = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=15)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-seconds", type=float, default=1.5,
+                        help="fail when the median `import app` time is above this")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/startup-<time>-<rev>.json)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        imports = [measure_import(workdir) for _ in range(args.runs)]
+        servers = [measure_server(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import_seconds = [run["seconds"] for run in imports]
+    loaded = sorted({module for run in imports for module in run["loaded"]})
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "runs": args.runs,
+        "import_seconds": {"median": statistics.median(import_seconds), "max": max(import_seconds)},
+        "eagerly_loaded": loaded,
+    }
+    for key in ("home", "validation"):
+        values = [run[key] for run in servers if key in run]
+        if values:
+            result[f"{key}_ready_seconds"] = {"median": statistics.median(values), "max": max(values)}
+
+    print(f"import app:       median {result['import_seconds']['median']:.3f}s, max {result['import_seconds']['max']:.3f}s")
+    for key, label in (("home", "GET / ready"), ("validation", "validation ready")):
+        if f"{key}_ready_seconds" in result:
+            s = result[f"{key}_ready_seconds"]
+            print(f"{label + ':':<18}median {s['median']:.3f}s, max {s['max']:.3f}s")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = args.output or os.path.join(
+        RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}-{result['revision']}.json")
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {out_path}")
+
+    failures = []
+    if loaded:
+        failures.append(f"loaded at import: {', '.join(loaded)}")
+    if result["import_seconds"]["median"] > args.max_import_seconds:
+        failures.append(f"median import {result['import_seconds']['median']:.3f}s > {args.max_import_seconds}s")
+    if len([run for run in servers if "validation" in run]) < args.runs:
+        failures.append("the submission endpoint did not validate during some runs")
+    if failures:
+        print("❌ Startup regression: " + "; ".join(failures))
+        sys.exit(1)
+    print("✅ Startup within limits")
+
+
+if __name__ == "__main__":
+    main()
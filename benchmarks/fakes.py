@@ -0,0 +1,313 @@
+"""
+Local stand-ins for the services app.py talks to, used by the benchmarks.
+
+- GitHub REST API: the user, repo, Git Data, Contents, Pages and compare
+  endpoints used by create_or_update_repo / enable_github_pages /
+  wait_for_pages_build / load_previous_code
+- OpenAI chat completions (streaming and non-streaming)
+- A Pages host serving the last built index.html of each repo
+- An evaluator that records when each notification arrives
+
+Every service adds a configurable latency to each request.
+"""
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+OWNER = "bench"
+
+
+def add_latency(app, latency, calls, name):
+    """Delay every request of a fake app and count it"""
+    @app.middleware("http")
+    async def delay(request, call_next):
+        calls[name] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        return await call_next(request)
+
+
+class FakeGitHub:
+    """In-memory repos with just enough Git Data API to push and diff trees"""
+
+    def __init__(self, pages_build_delay=2.0):
+        self.pages_build_delay = pages_build_delay
+        self.repos = {}
+        self.counter = itertools.count()
+
+    def new_sha(self):
+        return hashlib.sha1(f"bench-{next(self.counter)}".encode()).hexdigest()
+
+    @staticmethod
+    def blob_sha(data):
+        return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+    def repo_json(self, name):
+        return {
+            "name": name,
+            "full_name": f"{OWNER}/{name}",
+            "owner": {"login": OWNER},
+            "clone_url": f"https://github.com/{OWNER}/{name}.git",
+            "default_branch": "main"
+        }
+
+    def create_repo(self, name):
+        tree, commit = self.new_sha(), self.new_sha()
+        self.repos[name] = {
+            "ref": commit,
+            "commits": {commit: {"tree": tree, "parents": []}},
+            "trees": {tree: {}},
+            "blobs": {},
+            "pushed_at": time.monotonic()
+        }
+
+    def set_ref(self, repo, sha):
+        repo["ref"] = sha
+        repo["pushed_at"] = time.monotonic()
+
+    def build(self, name):
+        """Latest Pages build: the head commit, built pages_build_delay after the push"""
+        repo = self.repos[name]
+        built = time.monotonic() - repo["pushed_at"] >= self.pages_build_delay
+        return {"status": "built" if built else "building", "commit": repo["ref"]}
+
+    def is_ancestor(self, repo, ancestor, sha):
+        stack = [sha]
+        while stack:
+            current = stack.pop()
+            if current == ancestor:
+                return True
+            stack.extend(repo["commits"].get(current, {}).get("parents", []))
+        return False
+
+    def head_files(self, name):
+        repo = self.repos[name]
+        tree = repo["trees"][repo["commits"][repo["ref"]]["tree"]]
+        return {path: repo["blobs"][sha] for path, sha in tree.items()}
+
+    def app(self, latency, calls):
+        app = FastAPI()
+        add_latency(app, latency, calls, "github")
+        not_found = lambda: JSONResponse({"message": "Not Found"}, 404)
+
+        @app.get("/user")
+        def user():
+            return {"login": OWNER}
+
+        @app.get("/repos/{owner}/{name}")
+        def get_repo(owner, name):
+            return self.repo_json(name) if name in self.repos else not_found()
+
+        @app.post("/user/repos")
+        async def create_repo(request: Request):
+            name = (await request.json())["name"]
+            if name in self.repos:
+                return JSONResponse({"message": "name already exists on this account"}, 422)
+            self.create_repo(name)
+            return JSONResponse(self.repo_json(name), 201)
+
+        @app.get("/repos/{owner}/{name}/git/ref/heads/{branch}")
+        def get_ref(owner, name, branch):
+            return {"object": {"sha": self.repos[name]["ref"]}}
+
+        @app.get("/repos/{owner}/{name}/git/commits/{sha}")
+        def get_commit(owner, name, sha):
+            return {"sha": sha, "tree": {"sha": self.repos[name]["commits"][sha]["tree"]}}
+
+        @app.get("/repos/{owner}/{name}/git/trees/{sha}")
+        def get_tree(owner, name, sha):
+            entries = self.repos[name]["trees"][sha]
+            return {"sha": sha, "tree": [{"path": p, "sha": s, "type": "blob"} for p, s in entries.items()]}
+
+        @app.post("/repos/{owner}/{name}/git/blobs")
+        async def create_blob(owner, name, request: Request):
+            body = await request.json()
+            if body.get("encoding") == "base64":
+                data = base64.b64decode(body["content"])
+            else:
+                data = body["content"].encode()
+            sha = self.blob_sha(data)
+            self.repos[name]["blobs"][sha] = data
+            return JSONResponse({"sha": sha}, 201)
+
+        @app.get("/repos/{owner}/{name}/git/blobs/{sha}")
+        def get_blob(owner, name, sha):
+            data = self.repos[name]["blobs"].get(sha)
+            if data is None:
+                return not_found()
+            return {"sha": sha, "encoding": "base64", "content": base64.b64encode(data).decode(), "size": len(data)}
+
+        @app.post("/repos/{owner}/{name}/git/trees")
+        async def create_tree(owner, name, request: Request):
+            body = await request.json()
+            repo = self.repos[name]
+            entries = dict(repo["trees"][body["base_tree"]]) if body.get("base_tree") else {}
+            for entry in body["tree"]:
+                entries[entry["path"]] = entry["sha"]
+            sha = self.new_sha()
+            repo["trees"][sha] = entries
+            return JSONResponse({"sha": sha}, 201)
+
+        @app.post("/repos/{owner}/{name}/git/commits")
+        async def create_commit(owner, name, request: Request):
+            body = await request.json()
+            sha = self.new_sha()
+            self.repos[name]["commits"][sha] = {"tree": body["tree"], "parents": body["parents"]}
+            return JSONResponse({"sha": sha}, 201)
+
+        @app.patch("/repos/{owner}/{name}/git/refs/heads/{branch}")
+        async def update_ref(owner, name, branch, request: Request):
+            body = await request.json()
+            repo = self.repos[name]
+            if not body.get("force") and repo["ref"] not in repo["commits"][body["sha"]]["parents"]:
+                return JSONResponse({"message": "Update is not a fast forward"}, 422)
+            self.set_ref(repo, body["sha"])
+            return {"object": {"sha": body["sha"]}}
+
+        @app.get("/repos/{owner}/{name}/contents/{path:path}")
+        def get_contents(owner, name, path):
+            data = self.head_files(name).get(path)
+            if data is None:
+                return not_found()
+            return {"sha": self.blob_sha(data), "content": base64.b64encode(data).decode()}
+
+        @app.put("/repos/{owner}/{name}/contents/{path:path}")
+        async def put_contents(owner, name, path, request: Request):
+            body = await request.json()
+            repo = self.repos[name]
+            data = base64.b64decode(body["content"])
+            sha = self.blob_sha(data)
+            repo["blobs"][sha] = data
+            entries = dict(repo["trees"][repo["commits"][repo["ref"]]["tree"]])
+            entries[path] = sha
+            tree, commit = self.new_sha(), self.new_sha()
+            repo["trees"][tree] = entries
+            repo["commits"][commit] = {"tree": tree, "parents": [repo["ref"]]}
+            self.set_ref(repo, commit)
+            return JSONResponse({"commit": {"sha": commit}}, 201)
+
+        @app.post("/repos/{owner}/{name}/pages")
+        def enable_pages(owner, name):
+            return JSONResponse({"status": None}, 201)
+
+        @app.get("/repos/{owner}/{name}/pages")
+        def get_pages(owner, name):
+            return {"status": "built"}
+
+        @app.get("/repos/{owner}/{name}/pages/builds/latest")
+        def latest_build(owner, name):
+            return self.build(name) if name in self.repos else not_found()
+
+        @app.get("/repos/{owner}/{name}/compare/{base}...{head}")
+        def compare(owner, name, base, head):
+            repo = self.repos[name]
+            if base == head:
+                return {"status": "identical"}
+            return {"status": "ahead" if self.is_ancestor(repo, base, head) else "diverged"}
+
+        return app
+
+    def pages_app(self, latency, calls):
+        """Serves https://<owner>.github.io/<repo>/ as /<repo>/ once the build is done"""
+        app = FastAPI()
+        add_latency(app, latency, calls, "pages")
+
+        @app.get("/{name}/")
+        def site(name):
+            if name not in self.repos or self.build(name)["status"] != "built":
+                return Response(status_code=404)
+            html = self.head_files(name).get("index.html")
+            if html is None:
+                return Response(status_code=404)
+            return Response(html, media_type="text/html")
+
+        return app
+
+
+def fake_html(seed, size):
+    """A deterministic page of roughly `size` bytes"""
+    body = "".join(f"<p>Paragraph {i} for {seed}</p>\n" for i in range(max(size // 32, 1)))
+    return f"<!DOCTYPE html>\n<html>\n<head><title>{seed}</title></head>\n<body>\n{body}</body>\n</html>\n"
+
+
+def openai_app(latency, calls, ttft=0.5, tokens_per_second=1000.0, output_bytes=8000):
+    """
+    Chat completions returning an HTML page; streams in ~4 char tokens.
+    A system message seen before is reported as cached prompt tokens.
+    """
+    app = FastAPI()
+    add_latency(app, latency, calls, "openai")
+    seen_prefixes = set()
+
+    @app.post("/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        seed = hashlib.sha1(json.dumps(body["messages"], sort_keys=True).encode()).hexdigest()[:12]
+        html = fake_html(seed, output_bytes)
+        base = {"id": f"chatcmpl-{seed}", "created": int(time.time()), "model": body.get("model", "bench")}
+        usage = {"prompt_tokens": len(json.dumps(body["messages"])) // 4, "completion_tokens": len(html) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        system = "".join(m["content"] for m in body["messages"] if m["role"] == "system")
+        cached = len(system) // 4 if system in seen_prefixes else 0
+        usage["prompt_tokens_details"] = {"cached_tokens": cached}
+        seen_prefixes.add(system)
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + len(html) / 4 / tokens_per_second)
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": html}, "finish_reason": "stop"}],
+                "usage": usage
+            }
+
+        async def events():
+            await asyncio.sleep(ttft)
+            # Send ~50ms worth of tokens per event
+            step = max(int(tokens_per_second * 4 * 0.05), 4)
+            for start in range(0, len(html), step):
+                chunk = {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"content": html[start:start + step]}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(step / 4 / tokens_per_second)
+            done = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+class FakeEvaluator:
+    """Records (task, round) -> arrival time; optionally fails a share of requests"""
+
+    def __init__(self, failure_rate=0.0):
+        self.failure_rate = failure_rate
+        self.received = {}
+
+    def app(self, latency, calls):
+        app = FastAPI()
+        add_latency(app, latency, calls, "evaluator")
+
+        @app.post("/notify")
+        async def notify(request: Request):
+            if random.random() < self.failure_rate:
+                return Response(status_code=503)
+            body = await request.json()
+            self.received.setdefault((body["task"], body["round"]), time.time())
+            return {"status": "ok"}
+
+        return app
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    """A fresh job store in tmp_path, used by the app in place of JOBS_DB_PATH"""
+    store = app.JobStore(str(tmp_path / "jobs.db"), "host:1")
+    monkeypatch.setattr(app, "_job_store", store)
+    return store
@@ -0,0 +1,38 @@
+import asyncio
+import base64
+import os
+
+import pytest
+
+import app
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+@pytest.mark.parametrize("chunk_chars", [4, 7, 64, 64 * 1024])
+def test_decode_base64_to_file_across_chunk_boundaries(tmp_path, monkeypatch, chunk_chars):
+    monkeypatch.setattr(app, "BASE64_CHUNK_CHARS", chunk_chars)
+    encoded = base64.b64encode(DATA).decode()
+    # Line-wrapped like MIME output, and without its padding
+    wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76)).rstrip("=")
+    content = "data:application/octet-stream;base64," + wrapped
+    path = tmp_path / "out.bin"
+    app.decode_base64_to_file(content, content.index(",") + 1, str(path))
+    assert path.read_bytes() == DATA
+
+
+def test_attachments_are_saved_inside_the_app_folder(tmp_path):
+    folder = tmp_path / "app"
+    (folder / "sub").mkdir(parents=True)
+    attachments = [
+        {"name": "../escape.txt", "url": "data:text/plain;base64,aGk="},
+        {"name": "..", "url": "data:text/plain;base64,aGk="},
+        {"name": "sub", "url": "data:text/plain;base64,aGk="},
+        {"name": "notes.txt", "url": "data:text/plain;base64,aGk="},
+        {"name": "missing.txt"},
+    ]
+    saved = asyncio.run(app.decode_attachments(attachments, str(folder)))
+    assert sorted(info["name"] for info in saved) == ["escape.txt", "notes.txt"]
+    assert (folder / "notes.txt").read_bytes() == b"hi"
+    assert sorted(os.listdir(folder)) == ["escape.txt", "notes.txt", "sub"]
+    assert not (tmp_path / "escape.txt").exists()
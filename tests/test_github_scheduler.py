@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import app
+
+
+def response(status_code, headers=None, text=""):
+    return httpx.Response(status_code, headers=headers, text=text,
+                          request=httpx.Request("GET", "https://api.github.com/repos/o/r"))
+
+
+def blocked_for(scheduler):
+    return scheduler.blocked_until - time.monotonic()
+
+
+def test_retry_after_blocks_and_retries():
+    scheduler = app.GitHubScheduler(10, 20)
+    assert scheduler.observe(response(429, {"Retry-After": "7"})) is True
+    assert 6 < blocked_for(scheduler) <= 7
+
+
+def test_exhausted_primary_limit_waits_for_the_reset():
+    scheduler = app.GitHubScheduler(10, 20)
+    reset = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 30)}
+    # The last allowed call succeeds but nobody calls again before the reset
+    assert scheduler.observe(response(200, reset)) is False
+    assert 25 < blocked_for(scheduler) <= 32
+    assert scheduler.observe(response(403, reset, "API rate limit exceeded")) is True
+    assert scheduler.remaining == 0
+
+
+def test_secondary_limit_backs_off_exponentially_until_a_success():
+    scheduler = app.GitHubScheduler(10, 20)
+    secondary = response(403, text="You have exceeded a secondary rate limit")
+    assert scheduler.observe(secondary) is True
+    assert scheduler.secondary_backoff == app.GitHubScheduler.SECONDARY_BACKOFF_MIN
+    scheduler.observe(secondary)
+    assert scheduler.secondary_backoff == 2 * app.GitHubScheduler.SECONDARY_BACKOFF_MIN
+    assert blocked_for(scheduler) > app.GitHubScheduler.SECONDARY_BACKOFF_MIN
+    scheduler.observe(response(200))
+    assert scheduler.secondary_backoff == 0
+
+
+def test_other_errors_are_not_rate_limits():
+    scheduler = app.GitHubScheduler(10, 20)
+    assert scheduler.observe(response(403, text="Resource not accessible by integration")) is False
+    assert scheduler.observe(response(404)) is False
+    assert blocked_for(scheduler) <= 0
+
+
+def test_token_bucket_paces_calls_after_the_burst():
+    scheduler = app.GitHubScheduler(rate=20, burst=2)
+
+    async def calls(n):
+        started = time.monotonic()
+        for _ in range(n):
+            await scheduler.acquire()
+        return time.monotonic() - started
+
+    # Two from the burst, then one every 1/20 s
+    assert asyncio.run(calls(6)) == pytest.approx(4 / 20, abs=0.1)
+
+
+def test_pauses_are_shared_between_processes():
+    shared = {"until": 0.0}
+
+    def shared_pause(until):
+        shared["until"] = max(shared["until"], until)
+        return shared["until"]
+
+    seen_limit = app.GitHubScheduler(10, 20, shared_pause=shared_pause)
+    other = app.GitHubScheduler(10, 20, shared_pause=shared_pause)
+    seen_limit.observe(response(429, {"Retry-After": "5"}))
+    asyncio.run(seen_limit.sync_shared())
+    asyncio.run(other.sync_shared())
+    assert 4 < blocked_for(other) <= 5
@@ -0,0 +1,109 @@
+import socket
+
+import app
+
+
+def submission(task, round_number, nonce, **extra):
+    return {"task": task, "round": round_number, "nonce": nonce, "email": "e", "brief": "b",
+            "evaluation_url": f"http://evaluator/{nonce}", "secret": "s", **extra}
+
+
+def make_store(tmp_path, owner="host:1"):
+    return app.JobStore(str(tmp_path / "jobs.db"), owner)
+
+
+def test_jobs_of_a_task_never_run_at_the_same_time(tmp_path):
+    store = make_store(tmp_path)
+    first, _ = store.enqueue(submission("t", 1, "a"))
+    later, _ = store.enqueue(submission("t", 2, "b"))
+    other, _ = store.enqueue(submission("u", 1, "c"))
+    assert store.claim_next()["id"] == first["id"]
+    assert store.claim_next()["id"] == other["id"]
+    assert store.claim_next() is None
+    store.finish(first["id"], "done")
+    assert store.claim_next()["id"] == later["id"]
+
+
+def test_newer_submission_supersedes_queued_ones_of_the_same_round(tmp_path):
+    store = make_store(tmp_path)
+    old, _ = store.enqueue(submission("t", 1, "a"))
+    older, _ = store.enqueue(submission("t", 1, "b"))
+    newest, _ = store.enqueue(submission("t", 1, "c"))
+    # Jobs superseded by a job that is superseded in turn move over to the newest one
+    assert {job["id"] for job in store.superseded_jobs(newest["id"])} == {old["id"], older["id"]}
+    assert store.claim_next()["id"] == newest["id"]
+    assert store.claim_next() is None
+
+    assert store.settle_superseded(newest["id"], "failed", "boom") == 2
+    assert {store.get(job_id)["status"] for job_id in (old["id"], older["id"])} == {"failed"}
+    assert store.superseded_jobs(newest["id"]) == []
+
+
+def test_deploying_only_applies_to_a_running_job(tmp_path):
+    store = make_store(tmp_path)
+    job, _ = store.enqueue(submission("t", 1, "a"))
+    store.claim_next()
+    store.finish(job["id"], "done")
+    assert store.finish(job["id"], "deploying") is False
+    assert store.get(job["id"])["status"] == "done"
+
+
+def test_leases_keep_other_processes_out_until_they_lapse(tmp_path):
+    store = make_store(tmp_path, "host:1")
+    other = make_store(tmp_path, "host:2")
+    job, _ = store.enqueue(submission("t", 1, "a"))
+    assert store.claim_next()["id"] == job["id"]
+    assert other.claim_next() is None
+    assert other.finish(job["id"], "failed", "not mine") is False
+    assert store.renew_leases([job["id"]]) == {job["id"]}
+
+    store.conn.execute("UPDATE jobs SET lease_expires_at = 0 WHERE id = ?", (job["id"],))
+    taken = other.claim_next()
+    assert taken["id"] == job["id"] and taken["lease_owner"] == "host:2"
+    assert store.renew_leases([job["id"]]) == set()
+
+
+def test_jobs_of_a_dead_process_on_this_host_are_released(tmp_path):
+    dead = make_store(tmp_path, f"{socket.gethostname()}:999999999")
+    store = make_store(tmp_path, f"{socket.gethostname()}:1")
+    job, _ = dead.enqueue(submission("t", 1, "a"))
+    dead.claim_next()
+    assert store.claim_next() is None
+    assert store.release_dead_owners() == 1
+    assert store.claim_next()["id"] == job["id"]
+
+
+def test_round_one_rerun_is_claimed_before_a_queued_update(tmp_path):
+    store = make_store(tmp_path)
+    first, _ = store.enqueue(submission("t", 1, "a"))
+    assert store.claim_next()["id"] == first["id"]
+    store.finish(first["id"], "done")
+
+    rerun, _ = store.enqueue(submission("t", 1, "b"))
+    update, _ = store.enqueue(submission("t", 2, "c"))
+    assert update["priority"] == 0
+    assert store.claim_next()["id"] == rerun["id"]
+    # Round 2 waits for the running round 1 of the same task
+    assert store.claim_next() is None
+    store.finish(rerun["id"], "done")
+    assert store.claim_next()["id"] == update["id"]
+
+
+def test_done_jobs_keep_only_attachment_names_and_are_purged(tmp_path):
+    store = make_store(tmp_path)
+    attachments = [{"name": "data.csv", "url": "data:text/csv;base64," + "QUJD" * 1000}]
+    job, _ = store.enqueue(submission("t", 1, "a", attachments=attachments))
+    store.claim_next()
+    store.finish(job["id"], "done")
+    assert store.get(job["id"])["payload"]["attachments"] == [{"name": "data.csv"}]
+
+    failed, _ = store.enqueue(submission("u", 1, "b", attachments=attachments))
+    store.claim_next()
+    store.finish(failed["id"], "failed", "boom")
+    # Kept whole, a retry re-runs it
+    assert store.get(failed["id"])["payload"]["attachments"] == attachments
+
+    queued, _ = store.enqueue(submission("v", 1, "c"))
+    assert store.purge_finished(older_than=app.time.time() + 1) == 2
+    assert store.get(job["id"]) is None and store.get(failed["id"]) is None
+    assert store.get(queued["id"])["status"] == "queued"
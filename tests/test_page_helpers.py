@@ -0,0 +1,112 @@
+import app
+
+BOOTSTRAP_JS = "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"
+BOOTSTRAP_CSS = "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css"
+HIGHLIGHT_JS = "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/highlight.min.js"
+MARKED_JS = "https://cdn.jsdelivr.net/npm/marked/marked.min.js"
+
+
+def page(head="", body=""):
+    return f"<!DOCTYPE html><html><head>{head}</head><body>{body}</body></html>"
+
+
+def fixes(html_code):
+    return [fix for _, _, fix in app.find_page_problems(html_code) if fix]
+
+
+def test_companion_packages_are_not_rewritten():
+    html_code = page(
+        head=f'<link rel="stylesheet" href="{BOOTSTRAP_CSS}">'
+             '<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css">',
+        body=f'<script src="{MARKED_JS}"></script>'
+             '<script src="https://cdn.jsdelivr.net/npm/marked-highlight/lib/index.umd.js"></script>'
+             f'<script src="{HIGHLIGHT_JS}"></script>'
+             '<script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/languages/python.min.js"></script>'
+             f'<script src="{BOOTSTRAP_JS}"></script>',
+    )
+    assert fixes(html_code) == []
+    assert app.apply_page_fixes(html_code, app.find_page_problems(html_code)) == html_code
+
+
+def test_other_build_of_the_same_file_is_replaced():
+    old_js = "https://cdn.jsdelivr.net/npm/bootstrap@4.6.2/dist/js/bootstrap.min.js"
+    old_css = "https://stackpath.bootstrapcdn.com/bootstrap/4.5.0/css/bootstrap.min.css"
+    html_code = page(head=f'<link rel="stylesheet" href="{old_css}">', body=f'<script src="{old_js}"></script>')
+    fixed = app.apply_page_fixes(html_code, app.find_page_problems(html_code))
+    assert old_js not in fixed and BOOTSTRAP_JS in fixed
+    assert old_css not in fixed and BOOTSTRAP_CSS in fixed
+
+
+def test_missing_script_and_deprecated_marked_call():
+    html_code = page(body='<div id="out"></div><script>out.innerHTML = marked(text); hljs.highlightAll();</script>')
+    kinds = {kind for kind, _, _ in app.find_page_problems(html_code)}
+    assert kinds == {"missing-script", "marked"}
+    fixed = app.apply_page_fixes(html_code, app.find_page_problems(html_code))
+    assert "marked.parse(text)" in fixed
+    assert fixed.index(MARKED_JS) < fixed.index("<script>out.innerHTML")
+    assert HIGHLIGHT_JS in fixed
+    assert app.find_page_problems(fixed) == []
+
+
+def test_bootstrap_stylesheet_is_added_next_to_its_script():
+    html_code = page(body=f'<script src="{BOOTSTRAP_JS}"></script>')
+    fixed = app.apply_page_fixes(html_code, app.find_page_problems(html_code))
+    assert fixed.index(BOOTSTRAP_CSS) < fixed.index("</head>")
+
+
+def test_missing_local_file_is_reported():
+    html_code = page(body='<img src="logo.png"><img src="data.png">')
+    problems = app.find_page_problems(html_code, attachment_names=["data.png"])
+    assert [(kind, fix) for kind, _, fix in problems] == [("missing-file", None)]
+    assert "logo.png" in problems[0][1]
+
+
+def strip(chunks):
+    stripper = app.FenceStripper()
+    return "".join(stripper.feed(chunk) for chunk in chunks) + stripper.finish()
+
+
+def test_fence_stripper_removes_fences_split_across_chunks():
+    assert strip(["``", "`ht", "ml\n<html>", "<body>hi</body>", "</html>\n`", "``\n"]) == \
+        "<html><body>hi</body></html>"
+    assert strip(["```\n<p>x</p>\n```"]) == "<p>x</p>"
+
+
+def test_fence_stripper_leaves_unfenced_text_alone():
+    text = "<html><body><code>`a`</code></body></html>"
+    assert strip([text[:5], text[5:]]) == text
+
+
+def test_elide_previous_code_round_trips():
+    style = "body { color: red; }\n" * 200
+    code = f"<html><head><style>{style}</style></head><body><p>keep me</p></body></html>"
+    assert app.elide_previous_code(code, app.count_tokens(code)) == (code, {})
+
+    compacted, elided_blocks = app.elide_previous_code(code, 100)
+    assert list(elided_blocks.values()) == [style]
+    assert "keep me" in compacted and style not in compacted
+    assert app.restore_elided(compacted, elided_blocks) == code
+
+
+def test_git_blob_sha_matches_git_hash_object():
+    assert app.git_blob_sha(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+    assert app.git_blob_sha(b"hello\n") == "ce013625030ba8dba906f756967f9e9ca394464a"
+
+
+def test_elide_previous_code_without_budget_drops_the_code():
+    code = "<html><body>" + "<p>paragraph</p>\n" * 200 + "</body></html>"
+    for max_tokens in (0, -50):
+        compacted, elided_blocks = app.elide_previous_code(code, max_tokens)
+        assert elided_blocks == {}
+        assert "paragraph" not in compacted
+
+    compacted, _ = app.elide_previous_code(code, 20)
+    assert compacted.startswith("<html><body>") and compacted.endswith("</body></html>")
+    assert len(compacted) < len(code)
+
+
+def test_files_already_in_the_repo_are_not_missing():
+    html_code = page(head='<link rel="icon" href="favicon.ico">',
+                     body='<img src="sample.png"><script>fetch("./input.md")</script>')
+    assert [kind for kind, _, _ in app.find_page_problems(html_code)] == ["missing-file", "missing-file"]
+    assert app.find_page_problems(html_code, repo_files={"index.html", "input.md", "sample.png"}) == []
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+SECRET = "test-secret"
+
+
+@pytest.fixture
+def client(job_store, monkeypatch):
+    """Client for the submission endpoints; no lifespan, so nothing picks jobs up"""
+    monkeypatch.setattr(app, "EXPECTED_SECRET", SECRET)
+    monkeypatch.setattr(app, "nonce_cache", app.TTLCache(100, 3600))
+    return TestClient(app.app)
+
+
+def submission(task, round_number=1, nonce=None, **extra):
+    return {"secret": SECRET, "email": "e", "task": task, "round": round_number,
+            "nonce": nonce or f"{task}-{round_number}", "brief": "b",
+            "evaluation_url": "http://evaluator/notify", **extra}
+
+
+def test_enqueue_is_idempotent_on_task_round_and_nonce(job_store):
+    job, created = job_store.enqueue(submission("t"))
+    again, created_again = job_store.enqueue(submission("t"))
+    assert created and not created_again
+    assert again["id"] == job["id"]
+    assert "secret" not in job["payload"]
+
+    jobs = job_store.enqueue_many([submission("t"), submission("u"), submission("u")])
+    assert [(job_["task"], created_) for job_, created_ in jobs] == [("t", False), ("u", True), ("u", False)]
+    assert jobs[1][0]["id"] == jobs[2][0]["id"]
+
+
+def test_repeated_submission_returns_the_original_job(client, job_store):
+    first = client.post("/api-endpoint", json=submission("t"))
+    again = client.post("/api-endpoint", json=submission("t"))
+    assert first.status_code == again.status_code == 200
+    assert again.json()["job_id"] == first.json()["job_id"]
+    assert job_store.count_by_status() == {"queued": 1}
+
+
+def test_failed_or_superseded_jobs_are_looked_up_again(client, job_store):
+    job_id = client.post("/api-endpoint", json=submission("t")).json()["job_id"]
+    key = app.idempotency_key("t", 1, "t-1")
+    assert asyncio.run(app.cached_submission_response(key))["job_id"] == job_id
+
+    job_store.claim_next()
+    job_store.finish(job_id, "failed", "boom")
+    assert asyncio.run(app.cached_submission_response(key)) is None
+    # The retry re-queues the failed job instead of answering from the cache
+    assert client.post("/api-endpoint", json=submission("t")).json()["job_id"] == job_id
+    assert job_store.get(job_id)["status"] == "queued"
+
+    client.post("/api-endpoint", json=submission("t", nonce="newer"))
+    assert job_store.get(job_id)["status"] == "superseded"
+    assert asyncio.run(app.cached_submission_response(key)) is None
+
+
+def chunked(payload, size=100):
+    body = json.dumps(payload).encode()
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def test_oversized_bodies_get_413_with_or_without_content_length(client, monkeypatch):
+    monkeypatch.setattr(app, "ADMISSION_MAX_BUFFERED_BYTES", 2000)
+    big = submission("t", brief="x" * 3000)
+    assert client.post("/api-endpoint", json=big).status_code == 413
+    response = client.post("/api-endpoint", content=chunked(big), headers={"content-type": "application/json"})
+    assert response.status_code == 413
+    assert app.buffered_body_bytes == 0
+
+
+def test_bodies_beyond_the_buffered_total_get_503(client, monkeypatch):
+    monkeypatch.setattr(app, "ADMISSION_MAX_BUFFERED_BYTES", 2000)
+    monkeypatch.setattr(app, "buffered_body_bytes", 1900)
+    for kwargs in ({"json": submission("t")},
+                   {"content": chunked(submission("t")), "headers": {"content-type": "application/json"}}):
+        response = client.post("/api-endpoint", **kwargs)
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= app.ADMISSION_RETRY_AFTER
+    assert app.buffered_body_bytes == 1900
+
+
+def test_full_queue_gets_429_but_updates_still_get_in(client, job_store, monkeypatch):
+    monkeypatch.setattr(app, "ADMISSION_MAX_QUEUED_JOBS", 2)
+    job_id = client.post("/api-endpoint", json=submission("a")).json()["job_id"]
+    job_store.claim_next()
+    job_store.finish(job_id, "done")
+    assert client.post("/api-endpoint", json=submission("b")).status_code == 200
+    assert client.post("/api-endpoint", json=submission("c")).status_code == 200
+
+    response = client.post("/api-endpoint", json=submission("d"))
+    assert response.status_code == 429 and "Retry-After" in response.headers
+    update = client.post("/api-endpoint", json=submission("a", 2))
+    assert update.status_code == 200
+    assert job_store.get(update.json()["job_id"])["priority"] == 0
+
+
+def test_queued_attachment_bytes_beyond_the_limit_get_503(client, monkeypatch):
+    monkeypatch.setattr(app, "ADMISSION_MAX_QUEUED_BYTES", 1000)
+    assert client.post("/api-endpoint", json=submission("a")).status_code == 200
+    response = client.post("/api-endpoint", json=submission("b", brief="x" * 1000))
+    assert response.status_code == 503 and "Retry-After" in response.headers
+
+
+def test_batch_items_past_the_queue_limit_are_rejected(client, monkeypatch):
+    monkeypatch.setattr(app, "ADMISSION_MAX_QUEUED_JOBS", 2)
+    items = [{key: value for key, value in submission(task).items() if key != "secret"} for task in "abc"]
+    body = client.post("/api-endpoint/batch", json={"secret": SECRET, "submissions": items}).json()
+    assert (body["queued"], body["rejected"]) == (2, 1)
+    assert body["results"][2]["retry_after"] >= app.ADMISSION_RETRY_AFTER
+
+    response = client.post("/api-endpoint/batch", json={"secret": SECRET, "submissions": [submission("d")]})
+    assert response.status_code == 429